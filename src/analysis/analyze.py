@@ -1,10 +1,12 @@
 import os
 import json
 
-from operator import itemgetter
 from dotenv import load_dotenv
 
 from analyzer import Analyzer
+from model_registry import DEFAULT_MODEL, resolve_model
+from validation import load_medians, validate_features
+from ranking import Ranking, STATE_PATH, DIFF_PATH, update_ranking, ranking_diff, result
 
 
 def main() -> None:
@@ -17,26 +19,42 @@ def main() -> None:
     with open('./features.json') as cache:
         features = json.load(cache)
 
+    # Fill the missing features, a PR without some features is still ranked
+    imputed = validate_features(features, load_medians())
+    if imputed:
+        print(f"\t{imputed} missing feature values imputed in {sum('imputed' in pr for pr in features)} PRs")
+
     # Round floating point features:
-    for f in features:
-        feats: dict = f['features']
-        for key, val in feats.items():
-            if isinstance(val, float):
-                feats[key] = round(val, 3)
+    round_features(features)
 
     # Initialize analysis model
-    path = './src/analysis/preprocessing.pkl' if use_model == 'true' else None
+    path = resolve_model(os.getenv('MODEL') or DEFAULT_MODEL) if use_model == 'true' else None
     analyzer = Analyzer(path)
-    results = analyzer.analyze_prs(features)
+    analyzer.load_scores()
 
-    # Process each PR
-    ordered_results = sorted(results, key=itemgetter("effort"), reverse=True)
+    # Only the new and changed PRs are scored (through the score cache), the others keep their previous score
+    ranking = Ranking.load(STATE_PATH)
+    previous_ranks = ranking.ranks()
+    previous_entries = dict(ranking.entries)
+    changed = update_ranking(ranking, analyzer, features)
+    print(f"\t{changed} of {len(features)} PRs new or changed")
 
     # Write to file
-    write_to_json(ordered_results, "./results.json")
+    write_to_json([result(entry) for entry in ranking.top()], "./results.json")
+    write_to_json(ranking_diff(previous_ranks, previous_entries, ranking), DIFF_PATH)
+    ranking.save(STATE_PATH)
+    analyzer.save_scores()
+
+def round_features(features: list[dict]) -> None:
+    for f in features:
+        feats: dict = f['features']
+        for key, val in feats.items():
+            if isinstance(val, float):
+                feats[key] = round(val, 3)
 
-def write_to_json(data: list, path: str):
+def write_to_json(data: list | dict, path: str):
     with open(path, "w", encoding="utf-8") as output_file:
         json.dump(data, output_file, indent=2)
 
-main()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -1,101 +1,86 @@
+import os
+import json
 import random
-import pickle
-import copy
-import numpy as np
-import pandas as pd
+import hashlib
 
-from sklearn.preprocessing import StandardScaler
-from sklearn.exceptions import NotFittedError
-from sklearn.utils.validation import check_is_fitted
+from model_registry import MODEL_BACKEND, load_artifact, artifact_hash, create_scorer
 
-from model_configs import FEATURES, NUMERICAL_FEATURES, BOOL_FEATURES, weights as w, rules as r
+# Scores of the feature vectors already seen, valid as long as the model doesn't change
+SCORE_CACHE_PATH = './score_cache.json'
+SCORE_CACHE_SIZE = 10000
+
+def feature_hash(features: dict) -> str:
+    return hashlib.sha256(json.dumps(features, sort_keys=True).encode('utf-8')).hexdigest()
 
 class Analyzer:
-    def __init__(self, path=None) -> None:
+    def __init__(self, path=None, backend: str = MODEL_BACKEND) -> None:
         if path:
-            self.init_model(path)
+            self.init_model(path, backend)
         else:
             self.model = False
+            self.model_hash = 'stub'
             print("No model found! Analyzer initialized in STUB mode")
+        self.scores = {}
 
-    def init_model(self, path: str) -> None:
-        self.preprocessing_metadata = pickle.load(open(path, 'rb'))
-        self.weights = w
-        self.rules = r
+    def init_model(self, path: str, backend: str) -> None:
+        artifact = load_artifact(path)
+        self.scorer = create_scorer(artifact, backend)
         self.model = True
 
+        # Any change of the artifact (scaler, weights, rules or features) invalidates the cached scores
+        self.model_hash = artifact_hash(artifact)
+
+    def score_key(self, features: dict) -> str:
+        return f"{self.model_hash}:{feature_hash(features)}"
+
+    def load_scores(self, path: str = SCORE_CACHE_PATH) -> None:
+        if os.path.isfile(path):
+            with open(path, encoding='utf-8') as cache:
+                self.scores = {key: effort for key, effort in json.load(cache).items() if key.startswith(self.model_hash + ':')}
+
+    # Most recently used scores last, the oldest ones are dropped
+    def trim_scores(self) -> None:
+        if len(self.scores) > SCORE_CACHE_SIZE:
+            self.scores = dict(list(self.scores.items())[-SCORE_CACHE_SIZE:])
+
+    def save_scores(self, path: str = SCORE_CACHE_PATH) -> None:
+        self.trim_scores()
+        with open(path, 'w', encoding='utf-8') as cache:
+            json.dump(self.scores, cache)
+
     def analyze_prs(self, pr_features: list[dict]) -> list:
-        results = []
+        keys = [self.score_key(pr['features']) for pr in pr_features]
 
-        if self.model:
-            for pr in pr_features:
-                pr_result = {
-                    'title': pr['title'],
-                    'number': pr['number'],
-                    'effort': predict_value(pr['features'], self.preprocessing_metadata, self.weights, self.rules)
-                }
-                results.append(pr_result)
-        else:
-            for pr in pr_features:
-                pr_result = {
-                    'title': pr['title'],
-                    'number': pr['number'],
-                    'effort': random.random()
-                }
-                results.append(pr_result)
+        # Cache misses scored in one batch
+        missing = {key: pr['features'] for key, pr in zip(keys, pr_features) if key not in self.scores}
+        efforts = self.predict(list(missing.values()))
+        self.scores.update(zip(missing, efforts))
+
+        results = []
+        for key, pr in zip(keys, pr_features):
+            self.scores[key] = self.scores.pop(key)
+            pr_result = {
+                'title': pr['title'],
+                'number': pr['number'],
+                'effort': self.scores[key]
+            }
+            if 'imputed' in pr:
+                pr_result['imputed'] = pr['imputed']
+            add_repo(pr_result, pr)
+            results.append(pr_result)
 
+        # Bounded in the long running daemon too, which never saves them
+        self.trim_scores()
         return results
 
-def predict_value(row, preprocess_metadata, weights, rules, features_order = FEATURES,):
-    
-    row_np = np.array([row[f] for f in features_order])
-    preprocessed_row_np, _ = preprocess(pd.DataFrame([row_np], columns=features_order), preprocess_metadata)
-    preprocessed_row_dict = preprocessed_row_np.to_dict(orient='records')[0]
-    row_rules = []
-    for rule_name, rule_str in rules.items() : 
-        row_rules.append(evaluate_rule(preprocessed_row_dict, rule_str))
-    
-    ready_row = np.array([1] + preprocessed_row_np.values.tolist()[0] + row_rules)
-    prediction = np.matmul(weights.T, ready_row)
-    final_prediction = 1.0/(1.0 + np.exp(-prediction))
-    return final_prediction
-    
-     
-def evaluate_rule(row, rule_str): 
-    literals = rule_str.split(' & ')
-    for literal in literals: 
-        splitted_literal = literal.split(' ')
-        feature_name, operator, value = splitted_literal[0], splitted_literal[1], splitted_literal[2]
-        value = float(value)
-        if operator == '<=': 
-            res = row[feature_name] <= value
-        if operator == '>' : 
-            res = row[feature_name] > value
-        if not(res) : 
-            return 0
-    return 1
-
-def scale_data(data,features = NUMERICAL_FEATURES, scaler =  StandardScaler()) :
-    result = copy.deepcopy(data)
-    data_scaler = copy.deepcopy(scaler)
-    try: 
-        check_is_fitted(data_scaler) 
-        result[features] = data_scaler.transform(result[features])
-        
-    except NotFittedError: 
-        print('fit transform')
-        result[features] = data_scaler.fit_transform(result[features]) 
-    metadata = {
-        'scaler' : data_scaler,
-        'features' : features
-    }
-    return result, metadata
-
-def preprocess(data,preprocessing_metadata) : 
-    result = data.copy()
-    all_metadata = {}
-    #step 1: scaling 
-    result, scaling_metadata = scale_data(result,preprocessing_metadata['scaling']['features'],
-                                          scaler = preprocessing_metadata['scaling']['scaler'])
-    all_metadata['scaling'] = scaling_metadata 
-    return result, all_metadata
\ No newline at end of file
+    def predict(self, rows: list[dict]) -> list[float]:
+        if not rows:
+            return []
+        if self.model:
+            return self.scorer.score(rows)
+        return [random.random() for _ in rows]
+
+# PRs of a multi-repository run are tagged with their repository
+def add_repo(pr_result: dict, pr: dict) -> None:
+    if 'repo' in pr:
+        pr_result['repo'] = pr['repo']
@@ -0,0 +1,301 @@
+import os
+import json
+import math
+import time
+import pickle
+import hashlib
+import argparse
+import operator
+
+import numpy as np
+
+# Model artifacts: everything needed to score a PR in one JSON file (feature order, scaler parameters,
+# weights and rules), loaded into one of the scoring backends:
+#
+#   numpy    Vectorized batch scoring (default)
+#   python   Generated straight-line Python function, the fastest for a few PRs (webhook daemon)
+#   onnx     ONNX graph run by onnxruntime, for larger models (needs onnx and onnxruntime)
+#
+#   python model_registry.py export      preprocessing.pkl + model_configs.py -> models/effort.json
+#   python model_registry.py list        Available models
+#   python model_registry.py bench       Batch scoring latency of every backend
+#
+# A retrained model is dropped in by exporting it to models/ (or calling save_artifact) and selecting it
+# with the MODEL variable.
+
+ARTIFACT_FORMAT = 1
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+DEFAULT_MODEL = 'effort'
+
+MODEL_BACKEND = os.getenv('MODEL_BACKEND') or 'numpy'
+
+OPERATORS = {'<=': operator.le, '>': operator.gt}
+
+# Rules are conjunctions of 'feature <= value' / 'feature > value' literals on the scaled features
+def parse_rule(rule_str: str) -> list[list]:
+    conditions = []
+    for literal in rule_str.split(' & '):
+        feature, op, value = literal.split(' ')
+        conditions.append([feature, op, float(value)])
+    return conditions
+
+def save_artifact(path: str, features: list[str], scaled: list[str], mean: list[float], scale: list[float], weights: list[float], rules: dict[str, str]) -> dict:
+    artifact = {
+        'format': ARTIFACT_FORMAT,
+        'features': list(features),
+        'scaler': {'features': list(scaled), 'mean': [float(v) for v in mean], 'scale': [float(v) for v in scale]},
+        # Intercept, one weight per feature, then one per rule
+        'weights': [float(v) for v in weights],
+        'rules': [{'name': name, 'conditions': parse_rule(rule_str)} for name, rule_str in rules.items()],
+    }
+
+    if len(artifact['weights']) != 1 + len(artifact['features']) + len(artifact['rules']):
+        raise ValueError(f"{len(artifact['weights'])} weights for {len(artifact['features'])} features and {len(artifact['rules'])} rules")
+
+    with open(path, 'w', encoding='utf-8') as output:
+        json.dump(artifact, output, indent=1)
+    return artifact
+
+# Artifact of the model trained with the preprocessing pickle and model_configs.py
+def export_pickle(pickle_path: str, path: str) -> dict:
+    from model_configs import FEATURES, weights, rules
+
+    scaling = pickle.load(open(pickle_path, 'rb'))['scaling']
+    scaler = scaling['scaler']
+    return save_artifact(path, FEATURES, scaling['features'], scaler.mean_, scaler.scale_, weights, rules)
+
+def resolve_model(name: str) -> str:
+    return name if os.path.isfile(name) else os.path.join(MODELS_DIR, f"{name}.json")
+
+def list_models() -> list[str]:
+    return sorted(name[:-len('.json')] for name in os.listdir(MODELS_DIR) if name.endswith('.json'))
+
+def load_artifact(path: str) -> dict:
+    with open(path, encoding='utf-8') as artifact_file:
+        artifact = json.load(artifact_file)
+
+    if artifact.get('format') != ARTIFACT_FORMAT:
+        raise ValueError(f"{path}: unsupported artifact format {artifact.get('format')}")
+    return artifact
+
+def artifact_hash(artifact: dict) -> str:
+    return hashlib.sha256(json.dumps(artifact, sort_keys=True).encode('utf-8')).hexdigest()
+
+# Per feature offset and divisor, the features that are not scaled are left as they are
+def scaling_vectors(artifact: dict) -> tuple[np.ndarray, np.ndarray]:
+    scaler = artifact['scaler']
+    params = dict(zip(scaler['features'], zip(scaler['mean'], scaler['scale'])))
+    mean = np.array([params.get(feature, (0.0, 1.0))[0] for feature in artifact['features']])
+    scale = np.array([params.get(feature, (0.0, 1.0))[1] for feature in artifact['features']])
+    return mean, scale
+
+# Missing features are NaN: they propagate to the score and fail every rule literal
+def feature_matrix(artifact: dict, rows: list[dict]) -> np.ndarray:
+    return np.array([[np.nan if row[f] is None else row[f] for f in artifact['features']] for row in rows], dtype=np.float64).reshape(len(rows), len(artifact['features']))
+
+class NumpyScorer:
+    def __init__(self, artifact: dict):
+        self.artifact = artifact
+        self.mean, self.scale = scaling_vectors(artifact)
+        self.weights = np.array(artifact['weights'])
+
+        index = {feature: i for i, feature in enumerate(artifact['features'])}
+        self.rules = [[(index[feature], OPERATORS[op], value) for feature, op, value in rule['conditions']] for rule in artifact['rules']]
+
+    def score(self, rows: list[dict]) -> list[float]:
+        scaled = (feature_matrix(self.artifact, rows) - self.mean) / self.scale
+
+        design = np.ones((len(rows), len(self.weights)))
+        design[:, 1:1 + scaled.shape[1]] = scaled
+        for i, conditions in enumerate(self.rules):
+            matches = np.ones(len(rows), dtype=bool)
+            for column, compare, value in conditions:
+                matches &= compare(scaled[:, column], value)
+            design[:, 1 + scaled.shape[1] + i] = matches
+
+        with np.errstate(over='ignore'):
+            return (1.0 / (1.0 + np.exp(-(design @ self.weights)))).tolist()
+
+# Same computation as the NumPy backend unrolled into generated Python source, no array overhead per call
+class PythonScorer:
+    def __init__(self, artifact: dict):
+        self.artifact = artifact
+        self.source = generate_scorer(artifact)
+        namespace = {'exp': math.exp}
+        exec(compile(self.source, f"<model {artifact_hash(artifact)[:12]}>", 'exec'), namespace)
+        self.score_row = namespace['score']
+
+    def score(self, rows: list[dict]) -> list[float]:
+        nan = float('nan')
+        features = self.artifact['features']
+        return [self.score_row([nan if row[f] is None else float(row[f]) for f in features]) for row in rows]
+
+def generate_scorer(artifact: dict) -> str:
+    mean, scale = scaling_vectors(artifact)
+    weights = artifact['weights']
+    features = artifact['features']
+    index = {feature: i for i, feature in enumerate(features)}
+
+    lines = ['def score(x):']
+    for i, feature in enumerate(features):
+        if feature in artifact['scaler']['features']:
+            lines.append(f"    z{i} = (x[{i}] - {float(mean[i])!r}) / {float(scale[i])!r}")
+        else:
+            lines.append(f"    z{i} = x[{i}]")
+
+    terms = [f"{weights[1 + i]!r} * z{i}" for i in range(len(features))]
+    lines.append(f"    s = {weights[0]!r} + " + ' + '.join(terms))
+
+    for i, rule in enumerate(artifact['rules']):
+        conditions = ' and '.join(f"z{index[feature]} {op} {value!r}" for feature, op, value in rule['conditions'])
+        lines.append(f"    if {conditions}:")
+        lines.append(f"        s += {weights[1 + len(features) + i]!r}")
+
+    # exp() only of negative values, it overflows otherwise
+    lines += [
+        '    if s >= 0:',
+        '        return 1.0 / (1.0 + exp(-s))',
+        '    if s == s:',
+        '        return exp(s) / (1.0 + exp(s))',
+        '    return s',
+    ]
+    return '\n'.join(lines) + '\n'
+
+class OnnxScorer:
+    def __init__(self, artifact: dict):
+        import onnxruntime
+
+        self.artifact = artifact
+        self.session = onnxruntime.InferenceSession(onnx_model(artifact).SerializeToString(), providers=['CPUExecutionProvider'])
+
+    def score(self, rows: list[dict]) -> list[float]:
+        return self.session.run(None, {'x': feature_matrix(self.artifact, rows)})[0].reshape(-1).tolist()
+
+# Rules as a whole matrix: every literal is compared at once, a rule matches when all its literals do
+def onnx_model(artifact: dict):
+    from onnx import helper, numpy_helper, TensorProto
+
+    mean, scale = scaling_vectors(artifact)
+    features = artifact['features']
+    weights = np.array(artifact['weights'])
+    index = {feature: i for i, feature in enumerate(features)}
+    literals = [(rule_i, index[feature], op, value) for rule_i, rule in enumerate(artifact['rules']) for feature, op, value in rule['conditions']]
+    rule_sizes = np.array([len(rule['conditions']) for rule in artifact['rules']], dtype=np.float64)
+
+    membership = np.zeros((len(literals), len(artifact['rules'])))
+    for literal_i, (rule_i, _, _, _) in enumerate(literals):
+        membership[literal_i, rule_i] = 1.0
+
+    le = [i for i, literal in enumerate(literals) if literal[2] == '<=']
+    gt = [i for i, literal in enumerate(literals) if literal[2] == '>']
+    order = np.array(le + gt)
+
+    constants = {
+        'mean': mean,
+        'scale': scale,
+        'feature_weights': weights[1:1 + len(features)].reshape(-1, 1),
+        'intercept': weights[:1],
+        'rule_weights': weights[1 + len(features):].reshape(-1, 1),
+        'le_columns': np.array([literals[i][1] for i in le], dtype=np.int64),
+        'le_values': np.array([literals[i][3] for i in le]),
+        'gt_columns': np.array([literals[i][1] for i in gt], dtype=np.int64),
+        'gt_values': np.array([literals[i][3] for i in gt]),
+        'membership': membership[order] if len(order) else membership,
+        'rule_sizes': rule_sizes,
+    }
+
+    nodes = [
+        helper.make_node('Sub', ['x', 'mean'], ['centered']),
+        helper.make_node('Div', ['centered', 'scale'], ['z']),
+        helper.make_node('MatMul', ['z', 'feature_weights'], ['linear']),
+        helper.make_node('Gather', ['z', 'le_columns'], ['le_z'], axis=1),
+        helper.make_node('LessOrEqual', ['le_z', 'le_values'], ['le_match']),
+        helper.make_node('Gather', ['z', 'gt_columns'], ['gt_z'], axis=1),
+        helper.make_node('Greater', ['gt_z', 'gt_values'], ['gt_match']),
+        helper.make_node('Concat', ['le_match', 'gt_match'], ['literal_match'], axis=1),
+        helper.make_node('Cast', ['literal_match'], ['literal_values'], to=TensorProto.DOUBLE),
+        helper.make_node('MatMul', ['literal_values', 'membership'], ['matched']),
+        helper.make_node('Equal', ['matched', 'rule_sizes'], ['rule_match']),
+        helper.make_node('Cast', ['rule_match'], ['rule_values'], to=TensorProto.DOUBLE),
+        helper.make_node('MatMul', ['rule_values', 'rule_weights'], ['rules']),
+        helper.make_node('Add', ['linear', 'rules'], ['partial']),
+        helper.make_node('Add', ['partial', 'intercept'], ['logit']),
+        helper.make_node('Sigmoid', ['logit'], ['effort']),
+    ]
+
+    graph = helper.make_graph(
+        nodes,
+        'effort',
+        [helper.make_tensor_value_info('x', TensorProto.DOUBLE, [None, len(features)])],
+        [helper.make_tensor_value_info('effort', TensorProto.DOUBLE, [None, 1])],
+        [numpy_helper.from_array(value, name) for name, value in constants.items()],
+    )
+    # IR version of opset 13, readable by older runtimes
+    return helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)], ir_version=7)
+
+BACKENDS = {'numpy': NumpyScorer, 'python': PythonScorer, 'onnx': OnnxScorer}
+
+def create_scorer(artifact: dict, backend: str = MODEL_BACKEND):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown model backend {backend} ({', '.join(BACKENDS)})")
+
+    try:
+        return BACKENDS[backend](artifact)
+    except ImportError as e:
+        print(f"\tModel backend {backend} unavailable ({e}), scoring with numpy")
+        return NumpyScorer(artifact)
+
+def bench(path: str, sizes: list[int], repeat: int) -> None:
+    artifact = load_artifact(path)
+    mean, scale = scaling_vectors(artifact)
+
+    # Rows drawn around the training distribution, so that the rules match part of them
+    rng = np.random.default_rng(0)
+    values = mean + scale * rng.standard_normal((max(sizes), len(mean)))
+    rows = [dict(zip(artifact['features'], row)) for row in values.tolist()]
+
+    reference = NumpyScorer(artifact).score(rows)
+    print('| Backend | ' + ' | '.join(f"{size} PRs (ms)" for size in sizes) + ' | Max diff |')
+    print('| --- |' + ' ---: |' * (len(sizes) + 1))
+
+    for backend, scorer_class in BACKENDS.items():
+        try:
+            scorer = scorer_class(artifact)
+        except ImportError as e:
+            print(f"| {backend} | unavailable ({e}) |")
+            continue
+
+        timings = []
+        for size in sizes:
+            batch = rows[:size]
+            start_time = time.perf_counter()
+            for _ in range(repeat):
+                scorer.score(batch)
+            timings.append((time.perf_counter() - start_time) / repeat * 1000)
+
+        diff = max(abs(a - b) for a, b in zip(reference, scorer.score(rows)))
+        print(f"| {backend} | " + ' | '.join(f"{timing:.3f}" for timing in timings) + f" | {diff:.1e} |")
+
+def main():
+    parser = argparse.ArgumentParser(description='Export, list and benchmark the scoring models')
+    parser.add_argument('command', choices=['export', 'list', 'bench'])
+    parser.add_argument('--pickle', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'preprocessing.pkl'), help='preprocessing pickle to export')
+    parser.add_argument('--model', default=DEFAULT_MODEL, help='model name (in models/) or artifact path')
+    parser.add_argument('--sizes', default='1,10,100,1000', help='batch sizes benchmarked, comma separated')
+    parser.add_argument('--repeat', type=int, default=20, help='scoring repetitions per batch size')
+    args = parser.parse_args()
+
+    match args.command:
+        case 'export':
+            path = resolve_model(args.model)
+            artifact = export_pickle(args.pickle, path)
+            print(f"Model {path} exported ({len(artifact['features'])} features, {len(artifact['rules'])} rules)")
+        case 'list':
+            for name in list_models():
+                print(name)
+        case 'bench':
+            bench(resolve_model(args.model), [int(size) for size in args.sizes.split(',')], args.repeat)
+
+if __name__ == '__main__':
+    main()
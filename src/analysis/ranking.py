@@ -0,0 +1,95 @@
+import os
+import json
+from bisect import bisect_left, insort
+
+# Ranking kept between runs: the score key (model and feature hashes) and effort of every ranked PR, so that
+# only the PRs whose features changed are scored again, and the changes of the ranking can be listed for notifications
+STATE_PATH = './ranking_state.json'
+DIFF_PATH = './results_diff.json'
+
+# PR numbers are only unique within a repository (multi-repository runs)
+def pr_key(pr: dict) -> str:
+    return f"{pr['repo']}#{pr['number']}" if 'repo' in pr else str(pr['number'])
+
+class Ranking:
+    def __init__(self):
+        self.entries = {}
+        # (-effort, key), highest effort first
+        self.order = []
+
+    def add(self, key: str, entry: dict) -> None:
+        if key in self.entries:
+            self.remove(key)
+
+        entry['effort'] = float(entry['effort'])
+        self.entries[key] = entry
+        insort(self.order, (-entry['effort'], key))
+
+    def remove(self, key: str) -> None:
+        entry = self.entries.pop(key)
+        del self.order[bisect_left(self.order, (-entry['effort'], key))]
+
+    def top(self, k: int = None) -> list[dict]:
+        return [self.entries[key] for _, key in self.order[:k]]
+
+    # 1-based rank of every PR
+    def ranks(self) -> dict[str, int]:
+        return {key: rank for rank, (_, key) in enumerate(self.order, start=1)}
+
+    @classmethod
+    def load(cls, path: str = STATE_PATH) -> 'Ranking':
+        ranking = cls()
+        if os.path.isfile(path):
+            with open(path, encoding='utf-8') as state:
+                for key, entry in json.load(state).items():
+                    ranking.add(key, entry)
+        return ranking
+
+    def save(self, path: str = STATE_PATH) -> None:
+        with open(path, 'w', encoding='utf-8') as state:
+            json.dump({key: self.entries[key] for _, key in self.order}, state)
+
+# Ranked PR as written to results.json
+def result(entry: dict) -> dict:
+    return {name: value for name, value in entry.items() if name != 'hash'}
+
+# Scores the new PRs and the PRs whose features (or the model) changed, drops the PRs that are no longer open
+def update_ranking(ranking: Ranking, analyzer, features: list[dict]) -> int:
+    current = set()
+    changed = []
+    hashes = []
+
+    for pr in features:
+        key = pr_key(pr)
+        current.add(key)
+        digest = analyzer.score_key(pr['features'])
+
+        entry = ranking.entries.get(key)
+        if entry is None or entry['hash'] != digest:
+            changed.append(pr)
+            hashes.append(digest)
+        else:
+            entry['title'] = pr['title']
+
+    for key in [key for key in ranking.entries if key not in current]:
+        ranking.remove(key)
+
+    for pr, digest, scored in zip(changed, hashes, analyzer.analyze_prs(changed)):
+        ranking.add(pr_key(pr), {**scored, 'hash': digest})
+
+    return len(changed)
+
+def ranking_diff(before: dict[str, int], previous: dict[str, dict], ranking: Ranking) -> dict:
+    after = ranking.ranks()
+
+    def describe(entry: dict, **ranks) -> dict:
+        return {**result(entry), **ranks}
+
+    return {
+        'new': [describe(ranking.entries[key], rank=rank) for key, rank in after.items() if key not in before],
+        'moved': [
+            describe(ranking.entries[key], previous_rank=before[key], rank=rank)
+            for key, rank in after.items() if key in before and before[key] != rank
+        ],
+        'dropped': [describe(previous[key], previous_rank=rank) for key, rank in before.items() if key not in after],
+    }
@@ -0,0 +1,65 @@
+import os
+import json
+import warnings
+
+import numpy as np
+
+# Medians of the features over the extraction cache, written by the extraction next to the features
+MEDIANS_PATH = './feature_medians.json'
+
+def load_medians(path: str = MEDIANS_PATH) -> dict:
+    if not os.path.isfile(path):
+        print("No feature medians found! Missing features are filled with the medians of the ranked PRs")
+        return {}
+
+    with open(path, encoding='utf-8') as medians_file:
+        return json.load(medians_file)
+
+# The medians of a multi-repository run are by repository
+def repo_medians(medians: dict, repo: str | None) -> dict:
+    return (medians.get(repo) or {}) if repo is not None else medians
+
+def to_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def to_matrix(cells: np.ndarray) -> np.ndarray:
+    try:
+        return np.where(np.equal(cells, None), np.nan, cells).astype(np.float64)
+    except (TypeError, ValueError):
+        # Some values are not numbers, converted one by one
+        return np.vectorize(to_float, otypes=[np.float64])(cells)
+
+# Checks the feature matrix of all the PRs at once, and fills the missing and invalid values (None, NaN, infinite,
+# not a number) with the medians of the cache, or with the medians of the batch when the cache has none.
+# The filled features of a PR are listed in its 'imputed' field. Returns the number of filled values.
+def validate_features(features: list[dict], medians: dict) -> int:
+    if not features:
+        return 0
+
+    repos = [pr.get('repo') for pr in features]
+    known = [repo_medians(medians, repo) for repo in set(repos)]
+    names = list(dict.fromkeys([name for pr in features for name in pr['features']] + [name for m in known for name in m]))
+
+    values = to_matrix(np.array([[pr['features'].get(name) for name in names] for pr in features], dtype=object))
+    missing = ~np.isfinite(values)
+    if not missing.any():
+        return 0
+
+    vectors = {repo: to_matrix(np.array([repo_medians(medians, repo).get(name) for name in names], dtype=object)) for repo in set(repos)}
+    fill = np.array([vectors[repo] for repo in repos])
+
+    # Columns without any value have no median
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        batch = np.nan_to_num(np.nanmedian(np.where(missing, np.nan, values), axis=0), nan=0.0, posinf=0.0, neginf=0.0)
+    fill = np.where(np.isfinite(fill), fill, batch)
+
+    for row, column in zip(*np.nonzero(missing)):
+        pr = features[row]
+        pr['features'][names[column]] = float(fill[row, column])
+        pr.setdefault('imputed', []).append(names[column])
+
+    return int(missing.sum())
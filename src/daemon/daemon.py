@@ -0,0 +1,204 @@
+import os
+import sys
+import hmac
+import json
+import time
+import queue
+import hashlib
+import argparse
+import threading
+from operator import itemgetter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dotenv import load_dotenv
+from github import Github, Auth
+
+# Runs next to the extraction and analysis modules, with the dependencies of both installed
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(SRC_DIR, 'extraction'))
+sys.path.insert(0, os.path.join(SRC_DIR, 'analysis'))
+
+from db.db import Session, init_db, Project, PullRequest
+from extract import build_feature_dataset, build_pr_features, feature_medians
+from features.event import pull_from_payload
+from features.extractor import Extractor
+from tracing import TracedRetry
+from analyze import round_features, write_to_json
+from analyzer import Analyzer
+from validation import validate_features
+from model_registry import DEFAULT_MODEL, resolve_model
+
+# Long-running ranking: the feature cache and the model stay loaded, and every pull_request or
+# pull_request_review webhook updates the features and the score of the PR it concerns only.
+#
+#   python daemon.py                     Webhook endpoint on POST /webhook, ranking on GET /ranking
+#   python daemon.py --replay events     Processes recorded events (JSONL, {"event": ..., "payload": ...})
+#
+# The reference time of the features (DATETIME_NOW) is the daemon start, restart it daily (MAX_AGE).
+
+EVENTS = {'pull_request', 'pull_request_review'}
+
+DAEMON_PORT = int(os.getenv('DAEMON_PORT') or '8080')
+
+# Secret of the webhook, the payloads are not authenticated without it
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or ''
+
+
+class TriageDaemon:
+    def __init__(self, api: Github, repo: str, analyzer: Analyzer, results_path: str):
+        self.api = api
+        self.repo = repo
+        self.analyzer = analyzer
+        self.results_path = results_path
+        self.extractor = Extractor(api, repo)
+        self.ranking = {}
+        self.medians = {}
+        self.lock = threading.Lock()
+        self.events = queue.Queue()
+
+    def start(self, sync: bool) -> None:
+        init_db(False)
+
+        # Full run first, the events then only update the PRs they concern
+        if sync:
+            self.extractor.extract_features()
+
+        self.medians = feature_medians(self.repo)
+        self.rank(build_feature_dataset(self.repo))
+        self.write()
+        print(f"\t{len(self.ranking)} PRs ranked")
+
+    def handle(self, event: str, payload: dict) -> None:
+        if event not in EVENTS:
+            return
+
+        start_time = time.time()
+        pr = pull_from_payload(self.api, self.repo, payload)
+        if pr is None:
+            return
+
+        number = pr.number
+
+        if self.extractor.refresh_pull(pr):
+            with Session() as session:
+                project = session.query(Project).where(Project.name == self.repo).one()
+                features = build_pr_features(session.get(PullRequest, number), project)
+            self.rank([features])
+        else:
+            with self.lock:
+                self.ranking.pop(number, None)
+
+        self.write()
+        print(f"\t#{number} {event}.{payload.get('action')} processed in {time.time() - start_time}s")
+
+    def rank(self, features: list[dict]) -> None:
+        validate_features(features, self.medians)
+        round_features(features)
+        results = self.analyzer.analyze_prs(features)
+
+        with self.lock:
+            for result in results:
+                self.ranking[result['number']] = result
+
+    def results(self) -> list[dict]:
+        with self.lock:
+            return sorted(self.ranking.values(), key=itemgetter('effort'), reverse=True)
+
+    def write(self) -> None:
+        write_to_json(self.results(), self.results_path)
+
+    # Events are processed one at a time, in their order of arrival
+    def work(self) -> None:
+        while True:
+            event, payload = self.events.get()
+            try:
+                self.handle(event, payload)
+            except Exception as e:
+                print(f"\t{event} event failed: {e!r}")
+            finally:
+                self.events.task_done()
+
+    def replay(self, path: str) -> None:
+        with open(path, encoding='utf-8') as events:
+            for line in events:
+                if line.strip():
+                    record = json.loads(line)
+                    self.handle(record['event'], record['payload'])
+
+    def serve(self, port: int) -> None:
+        threading.Thread(target=self.work, daemon=True).start()
+
+        handler = type('Handler', (WebhookHandler,), {'triage': self})
+        server = ThreadingHTTPServer(('', port), handler)
+        print(f"\tListening on port {port}")
+        server.serve_forever()
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    triage: TriageDaemon = None
+
+    def do_POST(self):
+        if self.path != '/webhook':
+            return self.reply(404)
+
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if WEBHOOK_SECRET and not valid_signature(body, self.headers.get('X-Hub-Signature-256', '')):
+            return self.reply(401)
+
+        # Invalid JSON or encoding (both ValueError)
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return self.reply(400)
+
+        # Queued, GitHub expects an answer within seconds
+        self.triage.events.put((self.headers.get('X-GitHub-Event', ''), payload))
+        self.reply(202)
+
+    def do_GET(self):
+        if self.path != '/ranking':
+            return self.reply(404)
+        self.reply(200, self.triage.results())
+
+    def reply(self, status: int, data=None) -> None:
+        body = json.dumps(data).encode('utf-8') if data is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def valid_signature(body: bytes, signature: str) -> bool:
+    expected = 'sha256=' + hmac.new(WEBHOOK_SECRET.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+def main():
+    load_dotenv(override=True)
+
+    parser = argparse.ArgumentParser(description='Keep the PR ranking up to date from webhook events')
+    parser.add_argument('--port', type=int, default=DAEMON_PORT, help='port of the webhook endpoint')
+    parser.add_argument('--replay', help='process the events of this JSONL file and exit')
+    parser.add_argument('--skip-sync', action='store_true', help='rank the cached features without a full run first')
+    parser.add_argument('--results', default='./results.json', help='ranking file, rewritten after every event')
+    args = parser.parse_args()
+
+    token = os.environ.get("GITHUB_TOKEN")
+    repo = os.environ.get("GITHUB_REPO")
+    use_model = os.getenv("USE_MODEL", 'true')
+
+    auth = Auth.Token(token)
+    github_api = Github(auth=auth, retry=TracedRetry(backoff_factor=.25), per_page=100)
+    analyzer = Analyzer(resolve_model(os.getenv('MODEL') or DEFAULT_MODEL) if use_model == 'true' else None)
+
+    daemon = TriageDaemon(github_api, repo, analyzer, args.results)
+    daemon.start(not args.skip_sync)
+
+    if args.replay:
+        daemon.replay(args.replay)
+    else:
+        daemon.serve(args.port)
+
+if __name__ == '__main__':
+    main()
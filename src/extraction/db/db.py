@@ -5,16 +5,73 @@ import sqlalchemy as sa
 from sqlalchemy import ForeignKey, CheckConstraint, func
 from sqlalchemy.orm import Mapped, mapped_column, sessionmaker, DeclarativeBase, relationship
 
-db = sa.create_engine('sqlite:///cache.db', echo=False)
-Session = sessionmaker(bind=db)
+CACHE_PATH = os.getenv('CACHE_DB') or './cache.db'
+# Users cache shared by the repositories of a multi-repository run, in the repository cache otherwise
+USERS_PATH = os.getenv('USERS_DB') or ''
+
+db = sa.create_engine(f'sqlite:///{CACHE_PATH}', echo=False)
+# Written concurrently by the processes of every repository
+users_db = sa.create_engine(f'sqlite:///{USERS_PATH}', echo=False, connect_args={'timeout': 60}) if USERS_PATH else db
+
+# Version of the cache schema, kept in the SQLite user_version (checked when restoring snapshots)
+SCHEMA_VERSION = 3
+
+def add_column(table: str, column: str, column_type: str):
+    def migrate(conn) -> None:
+        inspector = sa.inspect(conn)
+        # Tables created by create_all already have the column
+        if inspector.has_table(table) and column not in {col['name'] for col in inspector.get_columns(table)}:
+            conn.exec_driver_sql(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+    return migrate
+
+def drop_table(table: str):
+    def migrate(conn) -> None:
+        conn.exec_driver_sql(f'DROP TABLE IF EXISTS {table}')
+    return migrate
+
+# Changes applied to an existing cache by each schema version (caches without version are at 1)
+MIGRATIONS = {
+    2: [add_column('users', 'last_access', 'DATETIME'), add_column('pr_author', 'last_access', 'DATETIME')],
+    # Per PR author rows, replaced by the shared author snapshots (they expire after MAX_AGE anyway)
+    3: [drop_table('pr_author')],
+}
+
+# Median of the non-null values of a column (of a table or a subquery), computed by SQLite in one query
+def median(session, column) -> float | None:
+    values = sa.select(column.label('value')).where(column.is_not(None)).subquery()
+    ranked = sa.select(
+        values.c.value,
+        func.row_number().over(order_by=values.c.value).label('position'),
+        func.count().over().label('total')
+    ).subquery()
+
+    # Middle value, or mean of the two middle values
+    middle = sa.or_(ranked.c.position == (ranked.c.total + 1) // 2, ranked.c.position == (ranked.c.total + 2) // 2)
+    return session.execute(sa.select(func.avg(ranked.c.value)).where(middle)).scalar()
 
 def init_db(cache_reset: bool) -> None:
     if cache_reset:
         print('Cached db entries will be reset')
-        if os.path.isfile('./cache.db'):
-            os.remove('./cache.db')
-
-    Base.metadata.create_all(db)
+        if os.path.isfile(CACHE_PATH):
+            os.remove(CACHE_PATH)
+
+    with db.begin() as conn:
+        version = conn.exec_driver_sql('PRAGMA user_version').scalar()
+        is_new = not sa.inspect(conn).has_table(PullRequest.__tablename__)
+
+    if users_db is db:
+        Base.metadata.create_all(db)
+    else:
+        Base.metadata.create_all(db, tables=[table for table in Base.metadata.sorted_tables if table is not User.__table__])
+        User.__table__.create(users_db, checkfirst=True)
+
+    with db.begin() as conn:
+        if not is_new:
+            for target in range(max(version, 1) + 1, SCHEMA_VERSION + 1):
+                print(f'Migrating cache to schema version {target}')
+                for migrate in MIGRATIONS[target]:
+                    migrate(conn)
+        conn.exec_driver_sql(f'PRAGMA user_version = {SCHEMA_VERSION}')
 
 class Base(DeclarativeBase):
     pass
@@ -40,31 +97,50 @@ class User(Base):
     experience: Mapped[float] = mapped_column(nullable=True)
     review_number: Mapped[int] = mapped_column(nullable=True)
     last_update: Mapped[datetime] = mapped_column(default=func.now(), onupdate=func.now())
+    last_access: Mapped[datetime] = mapped_column(nullable=True, default=func.now())
 
 
     def __status__(self) -> str:
         return f"<User(username={self.username}, type={self.type}, last_upd={self.last_update})>"
 
-class PrAuthor(Base):
-    __tablename__ = 'pr_author'
+Session = sessionmaker(bind=db, binds={User: users_db})
+
+# Author features shared by the PRs an author opened during the same time bucket (AUTHOR_BUCKET_DAYS)
+class AuthorSnapshot(Base):
+    __tablename__ = 'author_snapshots'
+    __table_args__ = (sa.UniqueConstraint('username', 'bucket'),)
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     username: Mapped[str]
+    bucket: Mapped[date]
     type: Mapped[str] = mapped_column (nullable=True)
-    experience: Mapped[float] = mapped_column(nullable=True)
+    registered: Mapped[date] = mapped_column(nullable=True)
     review_number: Mapped[int] = mapped_column(nullable=True)
     total_change_number: Mapped[int] = mapped_column(nullable=True)
     changes_per_week: Mapped[float] = mapped_column(nullable=True)
     global_merge_ratio: Mapped[float] = mapped_column(nullable=True)
     project_merge_ratio: Mapped[float] = mapped_column(nullable=True)
-    pr_date: Mapped[date] = mapped_column(nullable=True)
     last_update: Mapped[datetime] = mapped_column(default=func.now(), onupdate=func.now())
+    last_access: Mapped[datetime] = mapped_column(nullable=True, default=func.now())
 
-    pr_num: Mapped[int] = mapped_column(ForeignKey('pull_requests.number'))
-    pr: Mapped['PullRequest'] = relationship(back_populates='author_feat')
+    refs: Mapped[list['PrAuthorRef']] = relationship(back_populates='author')
 
     def __status__(self) -> str:
-        return f"<User(username={self.username}, type={self.type}, last_upd={self.last_update})>"
+        return f"<AuthorSnapshot(username={self.username}, bucket={self.bucket}, type={self.type}, last_upd={self.last_update})>"
+
+class PrAuthorRef(Base):
+    __tablename__ = 'pr_author_refs'
+
+    pr_num: Mapped[int] = mapped_column(ForeignKey('pull_requests.number'), primary_key=True)
+    snapshot_id: Mapped[int] = mapped_column(ForeignKey('author_snapshots.id'))
+    # Depends on the PR creation date
+    experience: Mapped[float] = mapped_column(nullable=True)
+
+    pr: Mapped['PullRequest'] = relationship(back_populates='author_ref')
+    author: Mapped[AuthorSnapshot] = relationship(back_populates='refs')
+
+    def __status__(self) -> str:
+        return f"<PrAuthorRef(pr={self.pr_num}, snapshot={self.snapshot_id}, exp={self.experience})>"
 
 class PrReviewers(Base):
     __tablename__ = 'pr_reviewers'
@@ -118,6 +194,28 @@ class PrCode(Base):
     def __status__(self) -> str:
         return f"<PrCode(pr={self.pr_num}, num_dir={self.num_of_directory}, mod_entropy={self.modify_entropy}, l_add={self.lines_added}, l_del={self.lines_deleted}, f_add={self.files_added}, f_del={self.files_deleted}, f_mod={self.files_modified}, num_subsys={self.subsystem_num})>"
 
+class ProjectActivity(Base):
+    __tablename__ = 'project_activity'
+
+    day: Mapped[date] = mapped_column(primary_key=True)
+    author: Mapped[str] = mapped_column(primary_key=True)
+    closed: Mapped[int] = mapped_column(default=0)
+    merged: Mapped[int] = mapped_column(default=0)
+
+    def __status__(self) -> str:
+        return f"<ProjectActivity(day={self.day}, author={self.author}, closed={self.closed}, merged={self.merged})>"
+
+class PrStale(Base):
+    __tablename__ = 'pr_stale'
+
+    pr_num: Mapped[int] = mapped_column(ForeignKey('pull_requests.number'), primary_key=True)
+    stage: Mapped[str] = mapped_column(primary_key=True)
+
+    pr: Mapped['PullRequest'] = relationship(back_populates='stale_feats')
+
+    def __status__(self) -> str:
+        return f"<PrStale(pr={self.pr_num}, stage={self.stage})>"
+
 class PullRequest(Base):
     __tablename__ = 'pull_requests'
 
@@ -130,10 +228,11 @@ class PullRequest(Base):
     closed: Mapped[datetime] = mapped_column(nullable=True)
     last_update: Mapped[datetime] = mapped_column(default=func.now(), onupdate=func.now())
 
-    author_feat: Mapped [PrAuthor | None] = relationship(back_populates='pr')
+    author_ref: Mapped[PrAuthorRef | None] = relationship(back_populates='pr')
     reviewer_feat: Mapped[PrReviewers | None] = relationship(back_populates='pr')
     text_feat: Mapped[PrText | None] = relationship(back_populates='pr')
     code_feat: Mapped[PrCode | None] = relationship(back_populates='pr')
+    stale_feats: Mapped[list[PrStale]] = relationship(back_populates='pr')
 
     def __status__(self) -> str:
         return f"<PR(pr={self.number}, title={self.title}, state={self.state})>"
\ No newline at end of file
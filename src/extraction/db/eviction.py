@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple
+
+from sqlalchemy import func, select, delete, update, Select, ColumnElement
+from sqlalchemy.orm import Session as OrmSession
+
+# Cached rows record their last access, eviction policies then drop the rows that are not worth
+# keeping at the end of each run so that the cache stays bounded on repos with many contributors
+
+# Rows never accessed since the column was added count from their last update
+def last_used(model) -> ColumnElement:
+    return func.coalesce(model.last_access, model.last_update)
+
+def record_access(session: OrmSession, key: ColumnElement, values: list) -> None:
+    if not values:
+        return
+
+    model = key.class_
+    # last_update is set to itself, an access must not reset the cache expiry
+    session.execute(
+        update(model)
+        .where(key.in_(values))
+        .values(last_access=datetime.now(timezone.utc).replace(tzinfo=None), last_update=model.last_update)
+        .execution_options(synchronize_session=False)
+    )
+
+class MaxAge:
+    def __init__(self, days: int):
+        self.days = days
+
+    def __str__(self) -> str:
+        return f"unused for {self.days} days"
+
+    def victims(self, model, candidates: Select) -> Select:
+        limit = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=self.days)
+        return candidates.where(last_used(model) < limit)
+
+# Least recently used rows over the limit
+class MaxRows:
+    def __init__(self, rows: int):
+        self.rows = rows
+
+    def __str__(self) -> str:
+        return f"over {self.rows} rows"
+
+    def victims(self, model, candidates: Select) -> Select:
+        return candidates.order_by(last_used(model).desc(), model.id.desc()).offset(self.rows)
+
+class EvictionRule(NamedTuple):
+    model: type
+    policies: list
+    # Rows that must be kept whatever the policies
+    keep: ColumnElement | None = None
+
+def evict(session: OrmSession, rules: list[EvictionRule]) -> list[tuple[str, str, int]]:
+    report = []
+
+    for rule in rules:
+        model = rule.model
+        for policy in rule.policies:
+            candidates = select(model.id)
+            if rule.keep is not None:
+                candidates = candidates.where(~rule.keep)
+
+            victims = policy.victims(model, candidates)
+            result = session.execute(delete(model).where(model.id.in_(victims)).execution_options(synchronize_session=False))
+            report.append((model.__tablename__, str(policy), result.rowcount))
+
+    return report
+
+def print_report(session: OrmSession, rules: list[EvictionRule], report: list[tuple[str, str, int]]) -> None:
+    for table, policy, evicted in report:
+        print(f"\tEvicted {evicted} {table} rows ({policy})")
+
+    for rule in rules:
+        remaining = session.query(func.count(rule.model.id)).scalar()
+        print(f"\t{remaining} {rule.model.__tablename__} rows cached")
@@ -3,24 +3,65 @@ import json
 import time
 
 from dotenv import load_dotenv
-from github import Github, Auth, GithubRetry
+from github import Github, Auth
 
-from db.db import Session, init_db, Project, PullRequest
+from db.db import db, Session, init_db, median, Project, PullRequest, AuthorSnapshot, PrAuthorRef, PrReviewers, PrText, PrCode
+from features.event import event_pull
 from features.extractor import Extractor
 from utils import time_exec
+from tracing import TracedRetry, install_tracing, write_summary
+
+# Medians of the features over the cache, used by the analysis to fill the features missing from a PR
+MEDIANS_PATH = './feature_medians.json'
+
+# Cache column of every PR feature (the project features are the same for all the PRs)
+FEATURE_COLUMNS = {
+    "author_experience": PrAuthorRef.experience,
+    "total_change_num": AuthorSnapshot.total_change_number,
+    "author_review_num": AuthorSnapshot.review_number,
+    "author_changes_per_week": AuthorSnapshot.changes_per_week,
+    "author_merge_ratio": AuthorSnapshot.global_merge_ratio,
+    "author_merge_ratio_in_project": AuthorSnapshot.project_merge_ratio,
+    "num_of_reviewers": PrReviewers.humans,
+    "num_of_bot_reviewers": PrReviewers.bots,
+    "avg_reviewer_experience": PrReviewers.avg_experience,
+    "avg_reviewer_review_count": PrReviewers.avg_reviews,
+    "description_length": PrText.description_len,
+    "is_documentation": PrText.is_documentation,
+    "is_bug_fixing": PrText.is_bug_fixing,
+    "is_feature": PrText.is_feature,
+    "num_of_directory": PrCode.num_of_directory,
+    "modify_entropy": PrCode.modify_entropy,
+    "lines_added": PrCode.lines_added,
+    "lines_deleted": PrCode.lines_deleted,
+    "files_modified": PrCode.files_modified,
+    "files_added": PrCode.files_added,
+    "files_deleted": PrCode.files_deleted,
+    "subsystem_num": PrCode.subsystem_num,
+}
 
 def main():
-    start_time = time.time()
-
     # Extract Env vars
     load_dotenv(override=True)
-    token = os.environ.get("GITHUB_TOKEN")
     repo = os.environ.get("GITHUB_REPO")
+
+    # Instrumentation
+    install_tracing(db)
+
+    run(repo, "./features.json", MEDIANS_PATH)
+
+    write_summary()
+
+# Extracts the features of the open PRs of the repository into the cache and the features file
+def run(repo: str, features_path: str, medians_path: str) -> list:
+    start_time = time.time()
+
+    token = os.environ.get("GITHUB_TOKEN")
     reset_cache = os.getenv("RESET_CACHE", 'false')
 
     # APIs
     auth = Auth.Token(token)
-    retry = GithubRetry(backoff_factor=.25)
+    retry = TracedRetry(backoff_factor=.25)
     github_api = Github(auth=auth, retry=retry, per_page=100)
 
     # Modules
@@ -31,44 +72,70 @@ def main():
 
     step_time = time_exec(start_time, "Init")
 
-    # Extract Features
-    extractor.extract_features()
+    # Extract Features, from the PR of the triggering event when the cache already holds the others
+    event_pr = event_pull(github_api, repo)
+    if event_pr is not None and has_cached_ranking(repo):
+        extractor.extract_event(event_pr)
+    else:
+        extractor.extract_features()
     step_time = time_exec(step_time, "Feature extract")
 
     # Dump features to json
     features = build_feature_dataset(repo)
-    write_to_json(features, "./features.json")
-
+    write_to_json(features, features_path)
+    write_to_json(feature_medians(repo), medians_path)
+    time_exec(step_time, "Dataset generation")
 
+    return features
 
+# A previous run ranked the open PRs: the project and the features of the open PRs are cached (a run stopped
+# before the feature stages leaves the project only)
+def has_cached_ranking(repo: str) -> bool:
+    with Session() as session:
+        if session.query(Project).where(Project.name == repo).count() == 0:
+            return False
+        return all(
+            session.query(model.pr_num).join(model.pr).where(PullRequest.state == 'open').first() is not None
+            for model in (PrAuthorRef, PrReviewers, PrText, PrCode)
+        )
 
 def write_to_json(data: list, path: str):
     with open(path, "w", encoding="utf-8") as output_file:
         json.dump(data, output_file, indent=2)
 
 def build_feature_dataset(repo: str):
-    start_time = time.time()
-
     with Session() as session:
         project = session.query(Project).where(Project.name == repo).one()
         prs = session.query(PullRequest).where(PullRequest.state == 'open').all()
         features = [build_pr_features(pr, project) for pr in prs]
 
-    print(f"Dataset generation done in {time.time() - start_time}s")
     return features
 
+def feature_medians(repo: str) -> dict:
+    with Session() as session:
+        medians = {name: median(session, column) for name, column in FEATURE_COLUMNS.items()}
+        project = session.query(Project).where(Project.name == repo).one()
+
+    medians["project_changes_per_week"] = project.changes_per_week
+    medians["changes_per_author"] = project.changes_per_author
+    medians["project_merge_ratio"] = project.merge_ratio
+    return medians
+
 def build_pr_features(pr: PullRequest, project: Project):
-    author_feat = pr.author_feat
-    reviewer_feat = pr.reviewer_feat
-    text_feat = pr.text_feat
-    code_feat = pr.code_feat
+    # PRs skipped by a budgeted run may miss some features, which are left empty
+    author_ref = pr.author_ref
+    author_feat = author_ref.author if author_ref is not None else AuthorSnapshot()
+    reviewer_feat = pr.reviewer_feat or PrReviewers()
+    text_feat = pr.text_feat or PrText()
+    code_feat = pr.code_feat or PrCode()
 
     return {
         'title': pr.title,
         'number': pr.number,
         'merged': pr.merged,
+        'stale': len(pr.stale_feats) > 0,
         'features': {
-            "author_experience": author_feat.experience,
+            "author_experience": author_ref.experience if author_ref is not None else None,
             "total_change_num": author_feat.total_change_number,
             "author_review_num": author_feat.review_number,
             "author_changes_per_week": author_feat.changes_per_week,
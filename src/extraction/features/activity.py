@@ -0,0 +1,55 @@
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, delete, select, Integer
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session as OrmSession
+
+from db.db import ProjectActivity, PullRequest as db_PR
+
+# Daily counters of closed/merged PRs per author, used to compute windowed project metrics
+# as a sum over at most HISTORY_RANGE_DAYS buckets instead of a scan of pull_requests
+
+def rebuild_activity(session: OrmSession) -> None:
+    session.execute(delete(ProjectActivity))
+    session.execute(insert(ProjectActivity).from_select(
+        ['day', 'author', 'closed', 'merged'],
+        select(
+            func.date(db_PR.closed),
+            db_PR.author,
+            func.count(),
+            func.sum(db_PR.merged.cast(Integer)),
+        ).where(db_PR.state == 'closed', db_PR.closed.is_not(None)).group_by(func.date(db_PR.closed), db_PR.author)
+    ))
+
+def ensure_activity(session: OrmSession) -> None:
+    # Caches created before the counters existed (or filled in bulk) are backfilled once
+    if session.query(ProjectActivity).first() is None:
+        rebuild_activity(session)
+
+def track_activity(session: OrmSession, pr: db_PR, delta: int) -> None:
+    if pr.state != 'closed' or pr.closed is None:
+        return
+
+    merged = delta if pr.merged else 0
+    stmt = insert(ProjectActivity).values(day=pr.closed.date(), author=pr.author, closed=delta, merged=merged)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['day', 'author'],
+        set_={
+            'closed': ProjectActivity.closed + stmt.excluded.closed,
+            'merged': ProjectActivity.merged + stmt.excluded.merged,
+        }
+    )
+    session.execute(stmt)
+
+    if delta < 0:
+        session.execute(delete(ProjectActivity).where(ProjectActivity.closed <= 0))
+
+def window_activity(session: OrmSession, end: datetime, days: int) -> tuple[int, int, int]:
+    first_day: date = end.date() - timedelta(days=days - 1)
+    closed, merged, authors = session.query(
+        func.coalesce(func.sum(ProjectActivity.closed), 0),
+        func.coalesce(func.sum(ProjectActivity.merged), 0),
+        func.count(ProjectActivity.author.distinct()),
+    ).where(ProjectActivity.day >= first_day, ProjectActivity.day <= end.date()).one()
+
+    return closed, merged, authors
@@ -0,0 +1,54 @@
+import time
+from datetime import timedelta
+
+from github import Github
+
+from db.db import Session, PrStale
+from features.config import RUN_BUDGET_MINUTES, API_RESERVE, DATETIME_NOW
+from tracing import count
+
+# Seconds between two rate-limit checks (the rate_limit endpoint is not counted against the quota)
+QUOTA_CHECK_INTERVAL = 10
+
+class RunBudget:
+    def __init__(self, api: Github):
+        self.api = api
+        self.deadline = None
+        self.spent = False
+        self.last_check = 0
+        self.remaining = None
+
+        if RUN_BUDGET_MINUTES > 0:
+            self.deadline = (DATETIME_NOW + timedelta(minutes=RUN_BUDGET_MINUTES)).timestamp()
+
+    def enabled(self) -> bool:
+        return self.deadline is not None or API_RESERVE > 0
+
+    def exhausted(self) -> bool:
+        # Once out of budget, the rest of the run is served from cache
+        if self.spent or not self.enabled():
+            return self.spent
+
+        if self.deadline is not None and time.time() >= self.deadline:
+            print("\tRun budget: time limit reached, falling back to cached features")
+            self.spent = True
+
+        elif API_RESERVE > 0:
+            if time.time() - self.last_check > QUOTA_CHECK_INTERVAL:
+                self.remaining = self.api.get_rate_limit().core.remaining
+                self.last_check = time.time()
+
+            if self.remaining < API_RESERVE:
+                print(f"\tRun budget: {self.remaining} API requests left, falling back to cached features")
+                self.spent = True
+
+        return self.spent
+
+def mark_stale(pr_nums: list[int], stage: str) -> None:
+    if not pr_nums:
+        return
+
+    count('budget', f"{stage}_stale", len(pr_nums))
+    with Session() as session:
+        session.add_all([PrStale(pr_num=num, stage=stage) for num in pr_nums])
+        session.commit()
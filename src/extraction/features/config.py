@@ -23,3 +23,60 @@ DATETIME_NOW = datetime.now(timezone.utc)
 LOAD_PAGES = 5
 LOAD_PRS = 100
 LOAD_PROCESSES = int(os.getenv('PREFILL_PROCESSES') or '2')
+
+# Run budget: wall-clock minutes available for feature computation (0 disables it)
+RUN_BUDGET_MINUTES = float(os.getenv('RUN_BUDGET') or '0')
+
+# Run budget: core API requests to keep in reserve before falling back to cached features (0 disables it)
+API_RESERVE = int(os.getenv('API_RESERVE') or '0')
+
+# Answer historical PR queries from an in-memory index instead of SQLite
+USE_HISTORY_INDEX = os.getenv('HISTORY_INDEX', 'false') == 'true'
+
+# Logins always (deny) or never (allow) considered as bots, comma separated
+BOT_ALLOWLIST = {login.strip().lower() for login in os.getenv('BOT_ALLOWLIST', '').split(',') if login.strip()}
+BOT_DENYLIST = {login.strip().lower() for login in os.getenv('BOT_DENYLIST', '').split(',') if login.strip()}
+
+# Feature rows written per transaction by the feature stages
+WRITE_CHUNK_SIZE = int(os.getenv('WRITE_CHUNK') or '500')
+
+# Title keywords flagging documentation and bug fixing PRs (documentation takes precedence), comma separated
+DEFAULT_DOC_KEYWORDS = 'doc,docs,documentation,readme,license,copyright'
+DEFAULT_BUG_KEYWORDS = 'bug,fix,repair,defect'
+DOC_KEYWORDS = [word.strip() for word in (os.getenv('DOC_KEYWORDS') or DEFAULT_DOC_KEYWORDS).split(',') if word.strip()]
+BUG_KEYWORDS = [word.strip() for word in (os.getenv('BUG_KEYWORDS') or DEFAULT_BUG_KEYWORDS).split(',') if word.strip()]
+
+# Local clone of the analyzed repository, used to list the files of PRs over the API limit of 3000 files
+GIT_REPO_PATH = os.getenv('GIT_REPO_PATH') or ''
+
+# Code features backend: 'api' lists the PR files through the API, 'git' diffs them in a local clone
+CODE_BACKEND = os.getenv('CODE_BACKEND') or 'api'
+
+# Blobless clone kept between runs by the git backend when GIT_REPO_PATH is not set
+GIT_CACHE_PATH = os.getenv('GIT_CACHE_PATH') or './repo.git'
+
+# Cache eviction: days without access after which cached users/author features are dropped,
+# and maximum number of rows kept in each table (0 disables the policy)
+CACHE_MAX_IDLE_DAYS = int(os.getenv('CACHE_MAX_IDLE') or '30')
+CACHE_MAX_USERS = int(os.getenv('CACHE_MAX_USERS') or '0')
+CACHE_MAX_AUTHORS = int(os.getenv('CACHE_MAX_AUTHORS') or '0')
+
+# Cached author/reviewer features expire after MAX_AGE days, +/- this fraction depending on the user
+TTL_JITTER = float(os.getenv('TTL_JITTER') or '0.25')
+
+# Serve expired author/reviewer features and refresh them in the background, at most REFRESH_BUDGET per stage
+STALE_WHILE_REVALIDATE = os.getenv('STALE_WHILE_REVALIDATE', 'false') == 'true'
+REFRESH_BUDGET = int(os.getenv('REFRESH_BUDGET') or '50')
+
+# Author features are computed once per author and time bucket of this many days, and shared by their PRs
+# (at least 1, one bucket per day)
+AUTHOR_BUCKET_DAYS = max(int(os.getenv('AUTHOR_BUCKET') or '7'), 1)
+
+# Reviewer profiles resolved at the same time (API lookups of the reviewers missing from the cache)
+REVIEWER_WORKERS = int(os.getenv('REVIEWER_WORKERS') or '4')
+
+# Count a reviewer once per PR, instead of once per review request and posted review
+DEDUP_REVIEWERS = os.getenv('DEDUP_REVIEWERS', 'false') == 'true'
+
+# Runs triggered by a PR event only update the features of that PR, the other open PRs are ranked from the cache
+EVENT_MODE = os.getenv('EVENT_MODE', 'false') == 'true'
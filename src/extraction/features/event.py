@@ -0,0 +1,33 @@
+import os
+import json
+
+from github import Github
+from github.PullRequest import PullRequest
+
+from features.config import EVENT_MODE
+
+# Runs triggered by a PR event: the PR is rebuilt from the webhook payload instead of fetched again,
+# its nested objects (author, base repository) are still completed through the API when needed
+PR_EVENTS = {'pull_request', 'pull_request_target', 'pull_request_review'}
+
+def pull_from_payload(api: Github, repo: str, payload: dict) -> PullRequest | None:
+    raw_pr = payload.get('pull_request')
+    if raw_pr is None or payload.get('repository', {}).get('full_name', '').lower() != repo.lower():
+        return None
+
+    # Review payloads carry a partial PR, without the line and file counts
+    if 'additions' not in raw_pr:
+        return api.get_repo(repo).get_pull(raw_pr['number'])
+
+    return api.create_from_raw_data(PullRequest, raw_pr)
+
+# PR of the event that triggered the workflow, if the run is event driven
+def event_pull(api: Github, repo: str) -> PullRequest | None:
+    event_path = os.getenv('GITHUB_EVENT_PATH')
+    if not EVENT_MODE or os.getenv('GITHUB_EVENT_NAME') not in PR_EVENTS or not event_path or not os.path.isfile(event_path):
+        return None
+
+    with open(event_path, encoding='utf-8') as event_file:
+        payload = json.load(event_file)
+
+    return pull_from_payload(api, repo, payload)
@@ -6,25 +6,40 @@ from math import ceil
 from github import Github
 from github.PullRequest import PullRequest
 from github.Repository import Repository
-from sqlalchemy import func
-
-from db.db import PrReviewers, Session, PullRequest as db_PR, PrText, PrCode, PrAuthor
-from features.config import LOAD_PROCESSES, LOAD_PRS
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session as OrmSession
+
+from db.db import PrReviewers, Session, PullRequest as db_PR, PrText, PrCode, AuthorSnapshot, PrAuthorRef, PrStale, User
+from db.eviction import EvictionRule, MaxAge, MaxRows, evict, print_report
+from features.config import LOAD_PROCESSES, LOAD_PRS, MAX_DATA_AGE, DATETIME_NOW, CACHE_MAX_IDLE_DAYS, CACHE_MAX_USERS, CACHE_MAX_AUTHORS
+from features.budget import RunBudget
+from features.activity import ensure_activity, track_activity
+from features.history_index import load_history_index
+from features.user_utils import BotDetector
 from features.features_project import project_features
 from features.features_code import code_features
 from features.features_reviewer import reviewer_features
 from features.features_author import  author_features
-from features.features_text import text_features
+from features.features_text import text_features, extract_text_features
+from tracing import record_stage, init_worker, flush_counters
 
 class Extractor:
     def __init__(self, api: Github, repo: str):
         self.api = api
         self.repo = repo
+        self.budget = RunBudget(api)
+        self.bots = BotDetector(repo)
 
     def extract_features(self) -> None:
         self.run_parallel()
         # self.run_seq()
 
+    # Event driven run: no sweep of the open PRs, only the PR of the event is updated
+    def extract_event(self, pr: PullRequest) -> None:
+        print(f"\tEvent run, updating PR #{pr.number} only")
+        project_features(self.repo)
+        self.refresh_pull(pr)
+
     def run_seq(self):
         # Sync PR states with project
         self.db_pr_state_refresh()
@@ -33,13 +48,17 @@ class Extractor:
         pull_requests = list(self.api.get_repo(full_name_or_id=self.repo).get_pulls(state='open'))
         pull_requests = [pr for pr in pull_requests if not pr.draft]
         self.db_cleanup(pull_requests)
+        pull_requests = prioritize_prs(pull_requests)
+        load_history_index()
 
         # Calc missing features
         project_features(self.repo)
         text_features(pull_requests)
-        code_features(pull_requests)
-        reviewer_features(self.api, pull_requests)
-        author_features(self.api, pull_requests)
+        code_features(pull_requests, self.budget, self.repo)
+        reviewer_features(self.api, pull_requests, self.bots, self.budget)
+        author_features(self.api, pull_requests, self.bots, self.budget)
+
+        self.db_evict(pull_requests)
 
     def run_parallel(self):
         # Sync PR states with project
@@ -49,12 +68,14 @@ class Extractor:
         pull_requests = list(self.api.get_repo(full_name_or_id=self.repo).get_pulls(state='open'))
         pull_requests = [pr for pr in pull_requests if not pr.draft]
         self.db_cleanup(pull_requests)
+        pull_requests = prioritize_prs(pull_requests)
+        load_history_index()
 
         proj_feat = mp.Process(target=project_features, args=(self.repo,))
         text_feat = mp.Process(target=text_features, args=(pull_requests,))
-        code_feat = mp.Process(target=code_features, args=(pull_requests,))
-        rev_feat = mp.Process(target=reviewer_features, args=(self.api, pull_requests))
-        author_feat = mp.Process(target=author_features, args=(self.api, pull_requests))
+        code_feat = mp.Process(target=code_features, args=(pull_requests, self.budget, self.repo))
+        rev_feat = mp.Process(target=reviewer_features, args=(self.api, pull_requests, self.bots, self.budget))
+        author_feat = mp.Process(target=author_features, args=(self.api, pull_requests, self.bots, self.budget))
 
         rev_feat.start()
         code_feat.start()
@@ -69,6 +90,8 @@ class Extractor:
         proj_feat.join()
         author_feat.join()
 
+        self.db_evict(pull_requests)
+
     def db_cleanup(self, prs: list[PullRequest]):
         start_time = time.time()
         prs_nums = [pr.number for pr in prs]
@@ -76,12 +99,31 @@ class Extractor:
         # Clear feature tables that must always be recalculated
         with Session() as session:
             session.query(PrText).delete()
-            session.query(PrReviewers).delete()
+            session.query(PrStale).delete()
+            session.query(PrReviewers).filter(~PrReviewers.pr_num.in_(prs_nums)).delete(synchronize_session='fetch')
             session.query(PrCode).filter(~PrCode.pr_num.in_(prs_nums)).delete(synchronize_session='fetch')
-            session.query(PrAuthor).filter(~PrAuthor.pr_num.in_(prs_nums)).delete(synchronize_session='fetch')
+            session.query(PrAuthorRef).filter(~PrAuthorRef.pr_num.in_(prs_nums)).delete(synchronize_session='fetch')
+            session.commit()
+
+        record_stage("DB Cleanup", start_time)
+
+    def db_evict(self, prs: list[PullRequest]):
+        start_time = time.time()
+        prs_nums = [pr.number for pr in prs]
+        open_snapshots = select(PrAuthorRef.snapshot_id).where(PrAuthorRef.pr_num.in_(prs_nums))
+
+        # Author features of the open PRs are part of the results
+        rules = [
+            EvictionRule(User, cache_policies(CACHE_MAX_USERS)),
+            EvictionRule(AuthorSnapshot, cache_policies(CACHE_MAX_AUTHORS), keep=AuthorSnapshot.id.in_(open_snapshots)),
+        ]
+
+        with Session() as session:
+            report = evict(session, rules)
             session.commit()
+            print_report(session, rules, report)
 
-        print(f"Step: \"DB Cleanup\" executed in {time.time() - start_time}s")
+        record_stage("Cache Eviction", start_time)
 
     def db_pr_state_refresh(self):
         start_time = time.time()
@@ -98,6 +140,8 @@ class Extractor:
             last_update = session.query(func.max(db_PR.last_update)).scalar()
 
         with Session() as session:
+            ensure_activity(session)
+
             # Perform updates only
             last_update = last_update.replace(tzinfo=timezone.utc)
             for pr in latest_updated:
@@ -105,24 +149,81 @@ class Extractor:
                 if pr.updated_at < (last_update - timedelta(seconds=since_step_start.seconds)):
                     break
 
-                pr_data = session.query(db_PR).filter_by(number=pr.number).first()
-                if pr_data:
-                    pr_data.title = pr.title
-                    pr_data.state = pr.state
-                    pr_data.merged = pr.merged
-                    pr_data.author = pr.user.login
-                    pr_data.created = pr.created_at
-                    pr_data.closed = pr.closed_at
-                else:
-                    if pr.state == 'open' and pr.draft:
-                        continue
-                    else:
-                        new_pr = create_pr_obj(pr)
-                        session.add(new_pr)
+                save_pr(session, pr)
+
+            session.commit()
+        record_stage("DB PR refresh", start_time)
+
+    # Single PR update (webhook events): only the features of this PR are recomputed, the other open PRs
+    # keep their cached ones. Returns False when the PR left the ranking (closed or back to draft)
+    def refresh_pull(self, pr: PullRequest) -> bool:
+        is_ranked = pr.state == 'open' and not pr.draft
 
+        with Session() as session:
+            ensure_activity(session)
+            save_pr(session, pr)
+
+            session.query(PrText).filter(PrText.pr_num == pr.number).delete()
+            session.query(PrStale).filter(PrStale.pr_num == pr.number).delete()
+            if not is_ranked:
+                session.query(PrReviewers).filter(PrReviewers.pr_num == pr.number).delete()
+                session.query(PrCode).filter(PrCode.pr_num == pr.number).delete()
+                session.query(PrAuthorRef).filter(PrAuthorRef.pr_num == pr.number).delete()
+            session.commit()
+
+        if not is_ranked:
+            return False
+
+        with Session() as session:
+            session.add_all(extract_text_features([pr]))
             session.commit()
-        print(f"Step: \"DB PR refresh\" executed in {time.time() - start_time}s")
 
+        code_features([pr], None, self.repo)
+        reviewer_features(self.api, [pr], self.bots)
+        author_features(self.api, [pr], self.bots)
+        return True
+
+
+# Process new PRs, then PRs without cached features, then the most recently updated ones,
+# so that a run cut short by its budget leaves only the least relevant PRs with stale data
+def prioritize_prs(prs: list[PullRequest]) -> list[PullRequest]:
+    new_after = DATETIME_NOW - timedelta(days=MAX_DATA_AGE)
+
+    with Session() as session:
+        with_author = {num for (num,) in session.query(PrAuthorRef.pr_num).all()}
+        with_code = {num for (num,) in session.query(PrCode.pr_num).all()}
+
+    def priority(pr: PullRequest):
+        is_new = pr.created_at >= new_after
+        is_cached = pr.number in with_author and pr.number in with_code
+        return (not is_new, is_cached, -pr.updated_at.timestamp())
+
+    return sorted(prs, key=priority)
+
+def save_pr(session: OrmSession, pr: PullRequest) -> None:
+    pr_data = session.query(db_PR).filter_by(number=pr.number).first()
+    if pr_data:
+        # Move the PR between daily activity buckets
+        track_activity(session, pr_data, -1)
+        pr_data.title = pr.title
+        pr_data.state = pr.state
+        pr_data.merged = pr.merged
+        pr_data.author = pr.user.login
+        pr_data.created = pr.created_at
+        pr_data.closed = pr.closed_at
+        track_activity(session, pr_data, 1)
+    elif not (pr.state == 'open' and pr.draft):
+        new_pr = create_pr_obj(pr)
+        session.add(new_pr)
+        track_activity(session, new_pr, 1)
+
+def cache_policies(max_rows: int) -> list:
+    policies = []
+    if CACHE_MAX_IDLE_DAYS > 0:
+        policies.append(MaxAge(CACHE_MAX_IDLE_DAYS))
+    if max_rows > 0:
+        policies.append(MaxRows(max_rows))
+    return policies
 
 def initial_save_prs(repo: Repository, pr_status: str):
     print(f"\tBeginning filling DB with {pr_status} PRs")
@@ -134,7 +235,7 @@ def initial_save_prs(repo: Repository, pr_status: str):
     if pr_status == 'open':
         prs = [pr for pr in prs if not pr.draft]
 
-    pool = mp.Pool(processes=LOAD_PROCESSES)
+    pool = mp.Pool(processes=LOAD_PROCESSES, initializer=init_worker)
     batch_size = LOAD_PRS
 
     def collect_result(result):
@@ -158,7 +259,7 @@ def fetch_all_pr_pages(repo: Repository, pr_status: str) -> list[PullRequest]:
     total_pages = ceil(total_prs / repo._requester.per_page)
     pages_per_proc = ceil(total_pages/LOAD_PROCESSES)
 
-    pool = mp.Pool(processes=LOAD_PROCESSES)
+    pool = mp.Pool(processes=LOAD_PROCESSES, initializer=init_worker)
     results = []
 
     # Fetch
@@ -184,15 +285,22 @@ def fetch_pr_pages(repo: Repository, pr_status: str, pages_num: int, from_page:
     results = []
     last_page = from_page + pages_num - 1
 
-    while from_page <= max_page and from_page <= last_page:
-        page = prs.get_page(from_page)
-        results.extend(page)
-        from_page += 1
+    try:
+        while from_page <= max_page and from_page <= last_page:
+            page = prs.get_page(from_page)
+            results.extend(page)
+            from_page += 1
+    finally:
+        # API calls of the worker, the parent doesn't see its counters
+        flush_counters()
 
     return results
 
 def db_create_pr_batch(pr_batch: list[PullRequest]):
-    return [create_pr_obj(pr) for pr in pr_batch]
+    try:
+        return [create_pr_obj(pr) for pr in pr_batch]
+    finally:
+        flush_counters()
 
 def create_pr_obj(pr: PullRequest) -> db_PR:
     return db_PR(
@@ -1,76 +1,133 @@
-import time
-from datetime import datetime, timedelta, timezone
-from statistics import median
+from datetime import date, datetime, timedelta
 
 from github import Github
 from github.NamedUser import NamedUser
 from github.PullRequest import PullRequest
 from github.Repository import Repository
-from sqlalchemy import func
+from sqlalchemy import func, update
 
-from db.db import Session, PrAuthor, PullRequest as db_PR
-from features.user_utils import is_bot_user, is_user_reviewer, try_get_total_prs, try_get_reviews_num
-from features.config import HISTORY_RANGE_DAYS, DAYS_PER_YEAR, DEFAULT_MERGE_RATIO, MAX_DATA_AGE, DATETIME_NOW
+from db.db import Session, median, AuthorSnapshot, PrAuthorRef, PullRequest as db_PR
+from db.eviction import record_access
+from features.budget import RunBudget, mark_stale
+from features.history_index import get_history_index
+from features.revalidate import Revalidator, expires_at
+from features.user_utils import BotDetector, get_reviewer_index, try_get_total_prs, try_get_reviews_num
+from features.config import HISTORY_RANGE_DAYS, DAYS_PER_YEAR, DEFAULT_MERGE_RATIO, DATETIME_NOW, AUTHOR_BUCKET_DAYS
+from tracing import stage, span, count
 
 HISTORY_WINDOW = timedelta(days=HISTORY_RANGE_DAYS)
-EXPIRY_WINDOW = timedelta(days=MAX_DATA_AGE)
 
-def author_features(api: Github, prs: list[PullRequest]) -> None:
-    start_time = time.time()
+@stage("Author Features")
+def author_features(api: Github, prs: list[PullRequest], bots: BotDetector, budget: RunBudget = None) -> None:
+    revalidator = Revalidator('author', api, budget)
 
     for pr in prs:
-        # step_time = time.time()
-        extract_author_feature(api, pr)
-        # print(f"\tPR({pr.number}): {pr.title} | {time.time() - step_time}s")
+        with span('pr', 'author', number=pr.number, author=pr.user.login):
+            extract_author_feature(api, pr, bots, budget, revalidator)
+
+    with span('step', 'revalidate'):
+        revalidator.join()
+
+    bots.save()
+
+    with Session() as session:
+        snapshot_ids = session.query(PrAuthorRef.snapshot_id).where(PrAuthorRef.pr_num.in_([pr.number for pr in prs]))
+        record_access(session, AuthorSnapshot.id, [snapshot_id for (snapshot_id,) in snapshot_ids])
+        session.commit()
 
     # Assign private user features based on median
-    step_time = time.time()
-    refresh_private_depended_stats()
-    print(f"Private dependent features updated in {time.time() - step_time}s")
+    with span('step', 'private_depended_stats'):
+        refresh_private_depended_stats()
 
-    print(f"Step: \"Author Features\" executed in {time.time() - start_time}s")
+# First day of the AUTHOR_BUCKET_DAYS long bucket containing the date
+def author_bucket(day: date) -> date:
+    return date.fromordinal(day.toordinal() - day.toordinal() % AUTHOR_BUCKET_DAYS)
 
-def extract_author_feature(api: Github, pr: PullRequest):
+def extract_author_feature(api: Github, pr: PullRequest, bots: BotDetector, budget: RunBudget = None, revalidator: Revalidator = None):
     author = pr.user
+    bucket = author_bucket(pr.created_at.date())
+
+    # Try retrieve from cache, the PRs of the author in the same bucket share their features
+    with Session() as session:
+        author_ref = session.get(PrAuthorRef, pr.number)
+        snapshot = session.query(AuthorSnapshot).where(AuthorSnapshot.username == author.login, AuthorSnapshot.bucket == bucket).one_or_none()
+
+    if snapshot is not None and DATETIME_NOW < expires_at(snapshot.last_update, author.login):
+        if author_ref is not None and author_ref.snapshot_id == snapshot.id:
+            count('cache', 'author_hit')
+        else:
+            count('cache', 'author_shared_hit')
+            link_author_snapshot(pr, snapshot)
+        return
+
+    # Out of budget: keep the expired features (if any)
+    if budget is not None and budget.exhausted():
+        if author_ref is None and snapshot is not None:
+            link_author_snapshot(pr, snapshot)
+        mark_stale([pr.number], 'author')
+        return
+
+    # Expired features are served while they are refreshed in the background
+    if snapshot is not None and revalidator is not None and revalidator.enabled():
+        count('cache', 'author_stale')
+        if author_ref is None or author_ref.snapshot_id != snapshot.id:
+            link_author_snapshot(pr, snapshot)
+        revalidator.submit(f"{author.login}@{bucket}", lambda thread_api: compute_author_snapshot(thread_api, pr, bots, bucket, thread_api.get_user(author.login)))
+        return
+
+    count('cache', 'author_miss')
+    link_author_snapshot(pr, compute_author_snapshot(api, pr, bots, bucket))
+
+# The author is fetched again by the threads not owning the PR (its user is bound to the API of the stage)
+def compute_author_snapshot(api: Github, pr: PullRequest, bots: BotDetector, bucket: date, author: NamedUser = None) -> AuthorSnapshot:
+    author = author or pr.user
     repo = pr.base.repo
     pr_creation = pr.created_at
 
-    # Try retrieve from cache
+    # Latest known type of the author
     with Session() as session:
-        author_feat_pr = session.query(PrAuthor).where(PrAuthor.pr_num == pr.number).one_or_none()
-        author_feat_sim = session.query(PrAuthor).where(PrAuthor.username == author.login).where(PrAuthor.pr_date == pr_creation.date()).first()
-
-    # Return if info present
-    if author_feat_pr or author_feat_sim:
-        if author_feat_pr: 
-            if DATETIME_NOW < author_feat_pr.last_update.replace(tzinfo=timezone.utc) + EXPIRY_WINDOW:
-                return
-            else:
-                with Session() as session:
-                    session.delete(author_feat_pr)
-                    session.commit()
-
-        if author_feat_sim and DATETIME_NOW < author_feat_sim.last_update.replace(tzinfo=timezone.utc) + EXPIRY_WINDOW:
-            create_from_similar(pr, author_feat_sim)
-            return
-
-    # Experience
-    registration_date = author.created_at
-    experience = (pr_creation.date() - registration_date.date()).days / DAYS_PER_YEAR
+        user_type = session.query(AuthorSnapshot.type).where(AuthorSnapshot.username == author.login).order_by(AuthorSnapshot.bucket.desc()).limit(1).scalar()
 
     # Depending on user type, different processing
     author_feats = {}
-    user_type = author_feat_pr.type if author_feat_pr else None
     match(user_type):
         case 'bot':
             author_feats = bot_author_features(repo, author, pr_creation)
         case 'private':
             author_feats = private_author_features(repo, author, pr_creation)
         case _:
-            author_feats = unknown_user_features(api, repo, author, pr_creation)
+            author_feats = unknown_user_features(api, repo, author, pr_creation, bots)
 
-    # Save/Update session
-    create_from_feats(pr, author_feats, experience)
+    # Save/Update session, in place so that the PRs referencing the snapshot see the new features
+    with Session() as session:
+        snapshot = session.query(AuthorSnapshot).where(AuthorSnapshot.username == author.login, AuthorSnapshot.bucket == bucket).one_or_none()
+        if snapshot is None:
+            snapshot = AuthorSnapshot(username=author.login, bucket=bucket)
+            session.add(snapshot)
+
+        snapshot.type = author_feats['type']
+        snapshot.registered = author.created_at.date()
+        snapshot.review_number = author_feats['review_number']
+        snapshot.total_change_number = author_feats['total_change_number']
+        snapshot.changes_per_week = author_feats['changes_per_week']
+        snapshot.global_merge_ratio = author_feats['global_merge_ratio']
+        snapshot.project_merge_ratio = author_feats['project_merge_ratio']
+        # Refreshed, even if the values didn't change
+        snapshot.last_update = func.now()
+        session.commit()
+        session.refresh(snapshot)
+
+    return snapshot
+
+def link_author_snapshot(pr: PullRequest, snapshot: AuthorSnapshot):
+    # Experience at the PR creation
+    experience = None
+    if snapshot.registered is not None:
+        experience = (pr.created_at.date() - snapshot.registered).days / DAYS_PER_YEAR
+
+    with Session() as session:
+        session.merge(PrAuthorRef(pr_num=pr.number, snapshot_id=snapshot.id, experience=experience))
+        session.commit()
 
 
 def bot_author_features(repo: Repository, author: NamedUser, fr_date: datetime):
@@ -78,29 +135,17 @@ def bot_author_features(repo: Repository, author: NamedUser, fr_date: datetime):
     author_name = author.login
 
     # closed/merged/total_changes
-    with Session() as session:
-        query = session.query(db_PR).filter(
-            db_PR.author == author.login,
-            db_PR.state == 'closed',
-            db_PR.closed <= fr_date,
-            db_PR.closed >= time_limit,
-        )
-        closed_prs = query.count()
-        merged_prs = query.where(db_PR.merged).count()
-        total_change_number = session.query(db_PR).where(db_PR.author == author_name).count()
-        rev_pr_nums = session.query(db_PR.number).filter(
-            db_PR.state == 'closed',
-            db_PR.closed <= fr_date,
-            db_PR.closed >= time_limit,
-        ).all()
-        rev_pr_nums = [pr.number for pr in rev_pr_nums]
+    closed_prs, merged_prs = author_window(author_name, time_limit, fr_date)
+
+    index = get_history_index()
+    if index is not None:
+        total_change_number = index.author_total(author_name)
+    else:
+        with Session() as session:
+            total_change_number = session.query(db_PR).where(db_PR.author == author_name).count()
 
     # review_num
-    review_number = 0
-    for pr_num in rev_pr_nums:
-        pr = repo.get_pull(pr_num)
-        if is_user_reviewer(pr, author):
-            review_number += 1
+    review_number = get_reviewer_index(repo).review_count(author_name, time_limit, fr_date)
 
     if closed_prs > 0:
         changes_per_week = closed_prs * (7/HISTORY_RANGE_DAYS)
@@ -125,16 +170,8 @@ def private_author_features(repo: Repository, author: NamedUser, fr_date: dateti
     time_limit = fr_date - HISTORY_WINDOW
 
     # Author project merge ratio
-    with Session() as session:
-        query = session.query(db_PR).filter(
-            db_PR.author == author.login,
-            db_PR.state == 'closed',
-            db_PR.closed <= fr_date,
-            db_PR.closed >= time_limit,
-        )
-        closed_pr_num = query.count()
-        merged_pr_num = query.where(db_PR.merged).count()
-        
+    closed_pr_num, merged_pr_num = author_window(author.login, time_limit, fr_date)
+
     global_merge_ratio = DEFAULT_MERGE_RATIO
     if closed_pr_num > 0:
         project_merge_ratio = merged_pr_num / closed_pr_num
@@ -151,46 +188,36 @@ def private_author_features(repo: Repository, author: NamedUser, fr_date: dateti
     }
 
 def refresh_private_depended_stats():
-    change_number = []
-    review_number = []
-    changes_per_week = []
-
     with Session() as session:
         pub_authors = session.query(
-            PrAuthor.username,
-            func.avg(PrAuthor.total_change_number).label('avg_change_number'),
-            func.avg(PrAuthor.review_number).label('avg_review_number'),
-            func.avg(PrAuthor.changes_per_week).label('avg_changes_per_week')
-        ).where(PrAuthor.type == 'public').group_by(PrAuthor.username).all()
-
-    if len(pub_authors) > 0:
-        for author in pub_authors:
-            change_number.append(author.avg_change_number)
-            review_number.append(author.avg_review_number)
-            changes_per_week.append(author.avg_changes_per_week)
-
-        change_number = median(change_number) if len(change_number) > 0 else 0
-        review_number = median(review_number) if len(review_number) > 0 else 0
-        changes_per_week = median(changes_per_week) if len(changes_per_week) > 0 else 0
-    else:
-        change_number = 0
-        review_number = 0
-        changes_per_week = 0
-
-    with Session() as session:
-        priv_authors = session.query(PrAuthor).where(PrAuthor.type == 'private').all()
-        for author in priv_authors:
-            author.total_change_number = change_number
-            author.review_number = review_number
-            author.changes_per_week = changes_per_week
+            AuthorSnapshot.username,
+            func.avg(AuthorSnapshot.total_change_number).label('avg_change_number'),
+            func.avg(AuthorSnapshot.review_number).label('avg_review_number'),
+            func.avg(AuthorSnapshot.changes_per_week).label('avg_changes_per_week')
+        ).where(AuthorSnapshot.type == 'public').group_by(AuthorSnapshot.username).subquery()
+
+        # Medians of the public authors computed by SQLite, 0 without public authors
+        change_number = median(session, pub_authors.c.avg_change_number) or 0
+        review_number = median(session, pub_authors.c.avg_review_number) or 0
+        changes_per_week = median(session, pub_authors.c.avg_changes_per_week) or 0
+
+        session.execute(
+            update(AuthorSnapshot).where(AuthorSnapshot.type == 'private').values(
+                total_change_number=change_number,
+                review_number=review_number,
+                changes_per_week=changes_per_week,
+                # Computed at the creation of the snapshot, the private snapshots expire like the others
+                last_update=AuthorSnapshot.last_update,
+            )
+        )
         session.commit()
 
-def unknown_user_features(api: Github, repo: Repository, author: NamedUser, fr_date: datetime):
+def unknown_user_features(api: Github, repo: Repository, author: NamedUser, fr_date: datetime, bots: BotDetector):
     author_name = author.login
     time_limit = fr_date - HISTORY_WINDOW
 
     # Detect bot user
-    if is_bot_user(author, repo):
+    if bots.is_bot(author):
         return bot_author_features(repo, author, fr_date)
 
     # Total changes created
@@ -216,15 +243,7 @@ def unknown_user_features(api: Github, repo: Repository, author: NamedUser, fr_d
         global_merge_ratio = global_pr_merged /global_pr_closed
 
         # Author project merge ratio
-        with Session() as session:
-            query = session.query(db_PR).filter(
-                db_PR.author == author_name,
-                db_PR.state == 'closed',
-                db_PR.closed <= fr_date,
-                db_PR.closed >= time_limit,
-            )
-            proj_closed_pulls = query.count()
-            proj_merged_pulls = query.where(db_PR.merged).count()
+        proj_closed_pulls, proj_merged_pulls = author_window(author_name, time_limit, fr_date)
 
         if proj_closed_pulls == 0:
             project_merge_ratio = DEFAULT_MERGE_RATIO
@@ -240,36 +259,17 @@ def unknown_user_features(api: Github, repo: Repository, author: NamedUser, fr_d
         'project_merge_ratio': project_merge_ratio,
     }
 
-def create_from_feats(pr: PullRequest, feats: dict, experience: float):
-    with Session() as session:
-        author_feat = PrAuthor(
-            username=pr.user.login,
-            type = feats['type'],
-            experience=experience,
-            review_number=feats['review_number'],
-            total_change_number = feats['total_change_number'],
-            changes_per_week = feats['changes_per_week'],
-            global_merge_ratio = feats['global_merge_ratio'],
-            project_merge_ratio = feats['project_merge_ratio'],
-            pr_date = pr.created_at.date(),
-            pr_num = pr.number,
-        )
-        session.add(author_feat)
-        session.commit()
+# Closed/merged PRs of the author in the project within the window
+def author_window(author_name: str, time_limit: datetime, fr_date: datetime) -> tuple[int, int]:
+    index = get_history_index()
+    if index is not None:
+        return index.author_window(author_name, time_limit, fr_date)
 
-def create_from_similar(pr: PullRequest, copy: PrAuthor):
     with Session() as session:
-        author_feat = PrAuthor(
-                username=copy.username,
-                type = copy.type,
-                experience=copy.experience,
-                review_number=copy.review_number,
-                total_change_number = copy.total_change_number,
-                changes_per_week = copy.changes_per_week,
-                global_merge_ratio = copy.global_merge_ratio,
-                project_merge_ratio = copy.project_merge_ratio,
-                pr_date = pr.created_at.date(),
-                pr_num = pr.number,
-            )
-        session.add(author_feat)
-        session.commit()
+        query = session.query(db_PR).filter(
+            db_PR.author == author_name,
+            db_PR.state == 'closed',
+            db_PR.closed <= fr_date,
+            db_PR.closed >= time_limit,
+        )
+        return query.count(), query.where(db_PR.merged).count()
@@ -1,97 +1,102 @@
-import time
-from datetime import timezone
-from scipy.stats import entropy
+import os
+import subprocess
+from datetime import datetime, timezone
+from typing import Iterator
+
 from github.PullRequest import PullRequest
 
 from db.db import Session, PrCode
+from features.budget import RunBudget, mark_stale
+from features.code_stats import CodeStats
+from features.config import CODE_BACKEND, GIT_REPO_PATH, GIT_CACHE_PATH
+from features.git_diff import GitRepo, pull_ref, git_error
+from features.writer import FeatureWriter
+from tracing import stage, span, count
+
+# Files listed by the API for a single PR
+MAX_LISTED_FILES = 3000
+
+@stage("Code Features")
+def code_features(prs:list[PullRequest], budget: RunBudget = None, repo_name: str = None):
+    git_repo = open_git_repo(prs, repo_name)
+    stale = []
+
+    # Update time of the cached features, in one query
+    with Session() as session:
+        cached = dict(session.query(PrCode.pr_num, PrCode.last_update).all())
+
+    with FeatureWriter() as writer:
+        for pr in prs:
+            with span('pr', 'code', number=pr.number, author=pr.user.login):
+                extract_code_feature(pr, writer, cached.get(pr.number), stale, budget, git_repo)
+
+    mark_stale(stale, 'code')
+
+def open_git_repo(prs: list[PullRequest], repo_name: str = None) -> GitRepo | None:
+    try:
+        if GIT_REPO_PATH:
+            git_repo = GitRepo(GIT_REPO_PATH)
+        elif CODE_BACKEND == 'git' and repo_name:
+            with span('git', 'clone'):
+                git_repo = GitRepo.clone(repo_name, GIT_CACHE_PATH, os.getenv('GITHUB_TOKEN'))
+        else:
+            return None
 
-def code_features(prs:list[PullRequest]):
-    start_time = time.time()
-
-    for pr in prs:
-        extract_code_feature(pr)
-
-    print(f"Step: \"Code Features\" executed in {time.time() - start_time}s")
+        # Git backend: every PR head and base in one batch of fetches
+        if CODE_BACKEND == 'git' and prs:
+            with span('git', 'fetch', prs=len(prs)):
+                git_repo.fetch_pulls([pr.number for pr in prs], [pr.base.sha for pr in prs])
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"\tGit repository unavailable ({git_error(e)}), listing PR files through the API")
+        return None
 
+    return git_repo
 
-def extract_code_feature(pr: PullRequest) -> PrCode:
-    # Try retrieve from cache
-    with Session() as session:
-        code_feat = session.query(PrCode).where(PrCode.pr_num == pr.number).one_or_none()
 
-    if code_feat is not None:
-        last_update = code_feat.last_update.replace(tzinfo=timezone.utc)
-        if pr.updated_at < last_update:
+def extract_code_feature(pr: PullRequest, writer: FeatureWriter, last_update: datetime | None, stale: list[int], budget: RunBudget = None, git_repo: GitRepo = None) -> None:
+    if last_update is not None:
+        if pr.updated_at < last_update.replace(tzinfo=timezone.utc):
+            count('cache', 'code_hit')
             return
-        else:
-          with Session() as session:
-            session.delete(code_feat)
-            session.commit()
-
-    # Features
-    modified_directories = 0
-    modify_entropy = 0
-    lines_added = pr.additions
-    lines_deleted = pr.deletions
-    files_modified = 0
-    files_added = 0
-    files_deleted = 0
-    subsystem_num = 0
-
-    # Temp vars
-    top_dir_changed = []
-    bot_dir_changes = []
-    entropy_pks = []
-    total_modified_lines = lines_added + lines_deleted
-
-    # Scan changed files
-    files = list(pr.get_files())
-    for file in files:
-        # Modified directories/subsystems
-        file_path = file.filename
-        split_path = file_path.split("/")
-
-        if len(split_path) > 1:
-            top = split_path[0]
-            bottom = file_path.rsplit('/', 1)[0]
-
-            if top_dir_changed.count(top) == 0:
-                top_dir_changed.append(top)
-
-            if bot_dir_changes.count(bottom) == 0:
-                bot_dir_changes.append(bottom)
-
-        # PK ratio for entropy
-        if total_modified_lines > 0 and file.changes > 0:
-            file_pk = file.changes / total_modified_lines
-            entropy_pks.append(file_pk)
-
-        # File changes
-        match file.status:
-            case "added":
-                files_added += 1
-            case "removed":
-                files_deleted += 1
-            case "modified" | "renamed" | "changed":
-                files_modified += 1
-
-    # Feature calc:
-    modified_directories = len(bot_dir_changes)
-    subsystem_num = len(top_dir_changed)
-    modify_entropy = entropy(entropy_pks, base=2) if len(entropy_pks) > 0 else 0
-
-    code_feat = PrCode(
-        num_of_directory = modified_directories,
-        modify_entropy = modify_entropy,
-        lines_added = lines_added,
-        lines_deleted = lines_deleted,
-        files_added = files_added,
-        files_deleted = files_deleted,
-        files_modified = files_modified,
-        subsystem_num = subsystem_num,
-        pr_num = pr.number
-    )
 
-    with Session() as session:
-        session.add(code_feat)
-        session.commit()
+    # Out of budget: keep the outdated features (if any)
+    if budget is not None and budget.exhausted():
+        stale.append(pr.number)
+        return
+
+    count('cache', 'code_miss')
+
+    # Scan changed files, line totals come from the diff itself with git
+    git_files = git_changed_files(pr, git_repo)
+    if git_files is not None:
+        code_feat = CodeStats().add_all(git_files).to_feature(pr.number)
+    else:
+        stats = CodeStats(pr.additions + pr.deletions).add_all(api_changed_files(pr))
+        code_feat = stats.to_feature(pr.number, pr.additions, pr.deletions)
+
+    # Replaces the outdated features (if any) when written
+    writer.add(code_feat, replace=last_update is not None)
+
+# Files from the local clone with the git backend, or when the API can't list all of them
+def git_changed_files(pr: PullRequest, git_repo: GitRepo = None) -> Iterator[tuple[str, str, int, int]] | None:
+    if git_repo is None or (CODE_BACKEND != 'git' and pr.changed_files <= MAX_LISTED_FILES):
+        return None
+
+    try:
+        # Already fetched by the git backend
+        if CODE_BACKEND != 'git':
+            git_repo.fetch_pulls([pr.number], [pr.base.sha])
+        files = git_repo.diff_files(pr.base.sha, pull_ref(pr.number))
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"\tPR #{pr.number}: git diff failed ({git_error(e)}), listing files through the API")
+        return None
+
+    count('code', 'git_diff')
+    return files
+
+def api_changed_files(pr: PullRequest) -> Iterator[tuple[str, str, int, int]]:
+    # The API stops listing files after MAX_LISTED_FILES
+    if pr.changed_files > MAX_LISTED_FILES:
+        count('code', 'truncated')
+
+    return ((file.filename, file.status, file.additions, file.deletions) for file in pr.get_files())
@@ -1,18 +1,18 @@
-import time
-from datetime import timedelta, timezone
+from datetime import datetime, time, timedelta, timezone
 
 from github import Github
 from github.PullRequest import PullRequest
-from db.db import Session, Project, PullRequest as db_PR
+from db.db import Session, Project
+from features.activity import window_activity
+from features.history_index import get_history_index
 from features.config import HISTORY_RANGE_DAYS, MAX_DATA_AGE, DATETIME_NOW
+from tracing import stage, count
 
-HISTORY_WINDOW = timedelta(days=HISTORY_RANGE_DAYS)
 EXPIRY_WINDOW = timedelta(days=MAX_DATA_AGE)
 DEFAULT_MERGE_RATIO = 0.5
 
+@stage("Project Features")
 def project_features(repo: str) -> None:
-    start_time = time.time()
-
     # Retrieve from db if present
     with Session() as session:
         project = session.get(Project, repo)
@@ -20,26 +20,21 @@ def project_features(repo: str) -> None:
     if project is not None:
         expiration = project.last_update.replace(tzinfo=timezone.utc) + EXPIRY_WINDOW
         if DATETIME_NOW < expiration:
-            print(f"Step: \"Project Features\" executed in {time.time() - start_time}s")
+            count('cache', 'project_hit')
             return
         else:
             with Session() as session:
                 session.delete(project)
                 session.commit()
 
-    # Latest 60-day window
-    time_limit = DATETIME_NOW - HISTORY_WINDOW
-
-    # Merge ratio and weekly metrics
-    with Session() as session:
-        query = session.query(db_PR).filter(
-            db_PR.state == 'closed',
-            db_PR.closed <= DATETIME_NOW,
-            db_PR.closed >= time_limit,
-        )
-        closed_prs = query.count()
-        merged_prs = query.where(db_PR.merged).count()
-        pr_authors = query.with_entities(db_PR.author).distinct().count()
+    # Merge ratio and weekly metrics over the latest N daily buckets
+    index = get_history_index()
+    if index is not None:
+        first_day = DATETIME_NOW.date() - timedelta(days=HISTORY_RANGE_DAYS - 1)
+        closed_prs, merged_prs, pr_authors = index.project_window(datetime.combine(first_day, time(), timezone.utc), DATETIME_NOW)
+    else:
+        with Session() as session:
+            closed_prs, merged_prs, pr_authors = window_activity(session, DATETIME_NOW, HISTORY_RANGE_DAYS)
 
     if closed_prs == 0:
         changes_per_author = 0
@@ -61,5 +56,4 @@ def project_features(repo: str) -> None:
 
         session.add(project)
         session.commit()
-        
-    print(f"Step: \"Project Features\" executed in {time.time() - start_time}s")
+
@@ -1,60 +1,96 @@
-import time
-from datetime import timedelta, timezone
+import threading
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
 
 from github import Github
 from github.Repository import Repository
 from github.PullRequest import PullRequest
 from github.NamedUser import NamedUser
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
 from db.db import Session, User, PrReviewers
+from db.eviction import record_access
+from features.budget import RunBudget, mark_stale
+from features.revalidate import Revalidator, expires_at
 
-from features.user_utils import is_bot_user, is_user_reviewer, try_get_reviews_num
-from features.config import HISTORY_RANGE_DAYS, DAYS_PER_YEAR, DATETIME_NOW, MAX_DATA_AGE
+from features.user_utils import BotDetector, api_copy, get_reviewer_index, try_get_reviews_num
+from features.config import HISTORY_RANGE_DAYS, DAYS_PER_YEAR, DATETIME_NOW, REVIEWER_WORKERS, DEDUP_REVIEWERS
+from tracing import stage, span, count
 
 HISTORY_WINDOW = timedelta(days=HISTORY_RANGE_DAYS)
-EXPIRY_WINDOW = timedelta(days=MAX_DATA_AGE)
 
-def reviewer_features(api: Github, prs: list[PullRequest]):
-    start_time = time.time()
-
-    reviewer_feats = [extract_reviewer_feature(api, pr) for pr in prs]
+# Cached reviewers read during the stage, their access time is recorded at the end
+accessed_users = set()
+
+@stage("Reviewer Features")
+def reviewer_features(api: Github, prs: list[PullRequest], bots: BotDetector, budget: RunBudget = None):
+    stale = []
+    revalidator = Revalidator('reviewer', api, budget)
+
+    # Reviewers of every PR first, the profile of each distinct reviewer is then resolved once for all the PRs
+    pr_reviewers = {}
+    for pr in prs:
+        # Out of budget: keep previously cached features
+        if budget is not None and budget.exhausted():
+            stale.append(pr.number)
+            continue
+
+        with span('pr', 'reviewer', number=pr.number, author=pr.user.login):
+            pr_reviewers[pr.number] = list_reviewers(pr)
+
+    users = {user.login: user for reviewers in pr_reviewers.values() for user in reviewers}
+    is_bot = {login: bots.is_bot(user) for login, user in users.items()}
+    humans = {login: user for login, user in users.items() if not is_bot[login]}
+
+    profiles = {}
+    if humans:
+        with span('step', 'resolve_reviewers', reviewers=len(humans)):
+            profiles = resolve_reviewers(api, prs[0].base.repo, humans, budget, revalidator)
+
+    with span('step', 'revalidate'):
+        revalidator.join()
+
+    reviewer_feats = []
+    for number, reviewers in pr_reviewers.items():
+        # Some reviewers were not resolved within the budget
+        if any(not is_bot[user.login] and user.login not in profiles for user in reviewers):
+            stale.append(number)
+        else:
+            reviewer_feats.append(aggregate_reviewers(number, reviewers, is_bot, profiles))
 
     with Session() as session:
+        computed = [feat.pr_num for feat in reviewer_feats]
+        session.query(PrReviewers).filter(PrReviewers.pr_num.in_(computed)).delete(synchronize_session='fetch')
         session.add_all(reviewer_feats)
+        record_access(session, User.username, list(accessed_users))
         session.commit()
 
-    print(f"Step: \"Reviewer Features\" executed in {time.time() - start_time}s")
+    mark_stale(stale, 'reviewer')
+    bots.save()
+
+# Requested reviewers, then the author of every posted review (a reviewer appears once per review)
+def list_reviewers(pr: PullRequest) -> list[NamedUser]:
+    reviewers = list(pr.requested_reviewers)
+    reviewers += [review.user for review in pr.get_reviews()]
 
-def extract_reviewer_feature(api: Github, pr: PullRequest):
-    # Temp data
-    requested_reviewers = pr.requested_reviewers
-    repo = pr.base.repo
-    reviews = pr.get_reviews()
+    if DEDUP_REVIEWERS:
+        reviewers = list({user.login: user for user in reviewers}.values())
+
+    return reviewers
+
+def aggregate_reviewers(number: int, reviewers: list[NamedUser], is_bot: dict[str, bool], profiles: dict[str, tuple]) -> PrReviewers:
     bot_reviewers = 0
     human_reviewers = 0
     total_reviewer_experience = 0
     total_reviewer_review_num = 0
 
-    # Reviewer feats for requested reviewers
-    for reviewer in requested_reviewers:
+    for reviewer in reviewers:
         # Bot/Human reviewer
-        if is_bot_user(reviewer, repo):
+        if is_bot[reviewer.login]:
             bot_reviewers += 1
         else:
             human_reviewers += 1
-            exp, revs = get_reviewer_feats(pr, repo, reviewer, api)
-            total_reviewer_experience += exp
-            total_reviewer_review_num += revs
-
-    # Reviewer features for posted reviews
-    for review in reviews:
-        reviewer = review.user
-
-        # Bot/Human reviewer
-        if is_bot_user(reviewer, repo):
-            bot_reviewers += 1
-        else:
-            human_reviewers += 1
-            exp, revs = get_reviewer_feats(pr, repo, reviewer, api)
+            exp, revs = profiles[reviewer.login]
             total_reviewer_experience += exp
             total_reviewer_review_num += revs
 
@@ -71,25 +107,58 @@ def extract_reviewer_feature(api: Github, pr: PullRequest):
         bots = bot_reviewers,
         avg_experience = avg_reviewer_experience,
         avg_reviews = avg_reviewer_review_count,
-        pr_num = pr.number
+        pr_num = number
     )
 
-def get_reviewer_feats(pr: PullRequest, repo: Repository, user: NamedUser, api: Github):
-    start_time = time.time()
-    user_exists = False
-    username = user.login
-    user_type = 'public'
+# (experience, review number) of every reviewer, from the cache in one query, the others computed concurrently
+def resolve_reviewers(api: Github, repo: Repository, users: dict[str, NamedUser], budget: RunBudget = None, revalidator: Revalidator = None) -> dict[str, tuple]:
+    accessed_users.update(users)
 
-    # Try retrieve from cache
     with Session() as session:
-        db_user = session.query(User).where(User.username == username).first()
-
-    if db_user is not None:
-        user_exists = True
-        expiration = db_user.last_update.replace(tzinfo=timezone.utc) + EXPIRY_WINDOW
-        if DATETIME_NOW < expiration:
-            # print(f"\tReviewer \"{username}\" returned cached data | {time.time() - start_time}s")
-            return db_user.experience, db_user.review_number
+        cached = {db_user.username: db_user for db_user in session.query(User).where(User.username.in_(list(users))).all()}
+
+    profiles = {}
+    missing = []
+    for username, user in users.items():
+        db_user = cached.get(username)
+
+        if db_user is not None and db_user.type != 'bot':
+            if DATETIME_NOW < expires_at(db_user.last_update, username):
+                count('cache', 'reviewer_hit')
+                profiles[username] = (db_user.experience, db_user.review_number)
+                continue
+
+            # Expired features are served while they are refreshed in the background
+            if revalidator is not None and revalidator.enabled():
+                count('cache', 'reviewer_stale')
+                revalidator.submit(username, lambda thread_api, login=username: compute_reviewer_feats(repo, thread_api.get_user(login), thread_api))
+                profiles[username] = (db_user.experience, db_user.review_number)
+                continue
+
+        count('cache', 'reviewer_miss')
+        missing.append(user)
+
+    # Every worker has its own API, the users are fetched again through it (the same call as completing them)
+    workers = threading.local()
+
+    def compute(user: NamedUser):
+        # Out of budget: the PRs of the reviewer keep their cached features
+        if budget is not None and budget.exhausted():
+            return None
+        if not hasattr(workers, 'api'):
+            workers.api = api_copy(api)
+        return compute_reviewer_feats(repo, workers.api.get_user(user.login), workers.api)
+
+    with ThreadPoolExecutor(max_workers=max(REVIEWER_WORKERS, 1)) as pool:
+        for user, feats in zip(missing, pool.map(compute, missing)):
+            if feats is not None:
+                profiles[user.login] = feats
+
+    return profiles
+
+def compute_reviewer_feats(repo: Repository, user: NamedUser, api: Github):
+    username = user.login
+    user_type = 'public'
 
     # Calc experience
     registration_date = user.created_at
@@ -100,26 +169,19 @@ def get_reviewer_feats(pr: PullRequest, repo: Repository, user: NamedUser, api:
     reviews = try_get_reviews_num(username, limit_date, DATETIME_NOW, api)
 
     if reviews is None:
-        reviews = 0
         user_type = 'private'
-        prs = repo.get_pulls(state='closed')
-        for pr in prs:
-            if pr.closed_at < limit_date:
-                break
-            if is_user_reviewer(pr, user):
-                reviews += 1
+        reviews = get_reviewer_index(repo).review_count(username, limit_date, DATETIME_NOW)
+
+    # Upsert, the users table may be shared with other repositories processed concurrently
+    stmt = insert(User).values(username=username, type=user_type, experience=experience, review_number=reviews)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['username'],
+        # Refreshed, even if the values didn't change
+        set_={'type': user_type, 'experience': experience, 'review_number': reviews, 'last_update': func.now()},
+    )
 
     with Session() as session:
-        if user_exists:
-            db_user = session.get(User, db_user.id)
-            db_user.type = user_type
-            db_user.experience = experience
-            db_user.review_number = reviews
-        else:
-            db_user = User(username=username, type=user_type, experience=experience, review_number=reviews)
-            session.add(db_user)
-
+        session.execute(stmt)
         session.commit()
 
-    # print(f"\tReviewer \"{username}\" added/updated | {time.time() - start_time}s")
     return experience, reviews
@@ -0,0 +1,53 @@
+import random
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+
+from db.db import Base, Session, PullRequest as db_PR
+
+FIXTURE_START = datetime(2023, 1, 1)
+
+# Synthetic PR history for the checks against the SQL queries: authors with a skewed activity, open and
+# closed PRs, PRs closed on the same second, and query times on the window boundaries. Dates are naive
+# UTC with a one second resolution, like the stored GitHub dates.
+def fixture_history(count: int, window: timedelta, seed: int = 0) -> tuple[list[tuple], list[tuple]]:
+    rng = random.Random(seed)
+    authors = [f"author{i}" for i in range(max(count // 20, 2))]
+
+    rows = []
+    for number in range(1, count + 1):
+        author = authors[min(int(rng.paretovariate(1.2)) - 1, len(authors) - 1)]
+        created = FIXTURE_START + timedelta(seconds=rng.randrange(365 * 86400))
+        state = 'open' if rng.random() < 0.1 else 'closed'
+        closed = created + timedelta(seconds=rng.randrange(30 * 86400)) if state == 'closed' else None
+
+        # Closed on the same second as the previous PR
+        if closed is not None and rows and rows[-1][4] is not None and rng.random() < 0.05:
+            closed = max(rows[-1][4], created)
+
+        rows.append((number, author, state, created, closed, closed is not None and rng.random() < 0.7))
+
+    # Every PR creation, then closing times at the end of a window, at its start and one second past it
+    queries = [(f"created-{number}", author, created) for number, author, _, created, _, _ in rows]
+    closed_rows = [row for row in rows if row[4] is not None]
+    for number, author, _, _, closed, _ in rng.sample(closed_rows, min(len(closed_rows), max(count // 10, 1))):
+        queries += [
+            (f"end-{number}", author, closed),
+            (f"start-{number}", author, closed + window),
+            (f"past-{number}", author, closed + window + timedelta(seconds=1)),
+        ]
+
+    return rows, queries
+
+# Sessions use an in-memory database holding the fixture instead of the local database
+def load_fixture(rows: list[tuple]) -> None:
+    engine = sa.create_engine('sqlite://', echo=False)
+    Base.metadata.create_all(engine)
+    Session.configure(bind=engine)
+
+    with Session() as session:
+        session.add_all([
+            db_PR(number=number, title=f"PR {number}", state=state, author=author, created=created, closed=closed, merged=merged)
+            for number, author, state, created, closed, merged in rows
+        ])
+        session.commit()
@@ -0,0 +1,86 @@
+import os
+import base64
+import subprocess
+from typing import Iterator
+
+# Raw diff status letters to the GitHub file statuses
+STATUSES = {'A': 'added', 'D': 'removed', 'M': 'modified', 'R': 'renamed', 'C': 'copied', 'T': 'changed'}
+
+# Refspecs per git fetch invocation
+FETCH_BATCH = 500
+
+def pull_ref(number: int) -> str:
+    return f'refs/pr-triage/{number}'
+
+class GitRepo:
+    # The token is passed to git through its environment, never on the command line (printed with a failed
+    # command) nor in the clone config
+    def __init__(self, path: str, token: str | None = None):
+        self.path = path
+        self.env = None
+        if token:
+            credentials = base64.b64encode(f'x-access-token:{token}'.encode()).decode()
+            # Actions only masks the raw token in the logs
+            print(f"::add-mask::{credentials}")
+            self.env = {
+                **os.environ,
+                'GIT_CONFIG_COUNT': '1',
+                'GIT_CONFIG_KEY_0': 'http.https://github.com/.extraheader',
+                'GIT_CONFIG_VALUE_0': f'AUTHORIZATION: basic {credentials}',
+            }
+
+    @classmethod
+    def clone(cls, repo_name: str, path: str, token: str | None = None) -> 'GitRepo':
+        repo = cls(path, token)
+        # Blobless clone: file contents are only downloaded when a diff needs them
+        if not os.path.isdir(path):
+            repo.run('clone', '--quiet', '--bare', '--filter=blob:none', f'https://github.com/{repo_name}.git', path)
+        return repo
+
+    def run(self, *args: str) -> bytes:
+        return subprocess.run(['git', *args], check=True, capture_output=True, env=self.env).stdout
+
+    def git(self, *args: str) -> bytes:
+        return self.run('-C', self.path, *args)
+
+    # Head of the PRs and their base commits, in as few fetches as possible
+    def fetch_pulls(self, numbers: list[int], base_shas: list[str] = ()) -> None:
+        refspecs = [f'+refs/pull/{number}/head:{pull_ref(number)}' for number in numbers] + sorted(set(base_shas))
+        for i in range(0, len(refspecs), FETCH_BATCH):
+            self.git('fetch', '--quiet', '--no-tags', 'origin', *refspecs[i:i + FETCH_BATCH])
+
+    # (path, status, additions, deletions) of every file changed between the merge base of base and head, and head
+    def diff_files(self, base: str, head: str) -> Iterator[tuple[str, str, int, int]]:
+        output = self.git('diff', '--no-color', '--no-ext-diff', '-M', '--raw', '--numstat', '-z', f'{base}...{head}')
+        return parse_diff(output)
+
+# Exit code and error output of a failed git command, without its arguments
+def git_error(e: OSError | subprocess.CalledProcessError) -> str:
+    if isinstance(e, subprocess.CalledProcessError):
+        return f"git exit code {e.returncode}: {e.stderr.decode('utf-8', 'replace').strip()}"
+    return e.strerror or type(e).__name__
+
+# With -z, the raw records (":modes shas status\0path\0", two paths for renames/copies) are followed
+# by the numstat records ("added\tdeleted\tpath\0", or "added\tdeleted\t\0src\0dst\0"), in the same order
+def parse_diff(output: bytes) -> Iterator[tuple[str, str, int, int]]:
+    tokens = output.decode('utf-8', 'surrogateescape').split('\0')
+    files = []
+    i = 0
+    while i < len(tokens) and tokens[i].startswith(':'):
+        status = tokens[i].split()[-1][0]
+        if status in 'RC':
+            files.append((tokens[i + 2], STATUSES[status]))
+            i += 3
+        else:
+            files.append((tokens[i + 1], STATUSES.get(status, 'modified')))
+            i += 2
+
+    for file_path, status in files:
+        added, deleted, name = tokens[i].split('\t', 2)
+        i += 1 if name else 3
+
+        # Binary files have no line counts
+        if added == '-':
+            yield file_path, status, 0, 0
+        else:
+            yield file_path, status, int(added), int(deleted)
@@ -0,0 +1,176 @@
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from db.db import Session, PullRequest as db_PR
+from features.config import USE_HISTORY_INDEX
+
+# Closing time of PRs that are not closed, sorts after every real date so they never fall in a window
+NOT_CLOSED = np.iinfo(np.int64).max
+
+STATES = {'open': 0, 'closed': 1}
+
+# In-memory columnar copy of the pull_requests history, loaded once per run. Rows are sorted per
+# author by closing time so that windowed author counts are two binary searches, and a project-wide
+# closing time order answers the project window queries (~46 bytes per PR)
+class PrHistoryIndex:
+    def __init__(self, rows: list[tuple[int, str, str, datetime, datetime | None, bool]]):
+        authors = {}
+        count = len(rows)
+
+        number = np.empty(count, dtype=np.int32)
+        author = np.empty(count, dtype=np.int32)
+        created = np.empty(count, dtype=np.int64)
+        closed = np.empty(count, dtype=np.int64)
+        merged = np.empty(count, dtype=np.bool_)
+        state = np.empty(count, dtype=np.int8)
+
+        for i, (pr_number, pr_author, pr_state, pr_created, pr_closed, pr_merged) in enumerate(rows):
+            number[i] = pr_number
+            author[i] = authors.setdefault(pr_author, len(authors))
+            created[i] = epoch(pr_created)
+            closed[i] = epoch(pr_closed) if pr_state == 'closed' and pr_closed is not None else NOT_CLOSED
+            merged[i] = bool(pr_merged)
+            state[i] = STATES.get(pr_state, -1)
+
+        # Per author, by closing time
+        order = np.lexsort((closed, author))
+        self.authors = authors
+        self.number = number[order]
+        self.author = author[order]
+        self.created = created[order]
+        self.closed = closed[order]
+        self.merged = merged[order]
+        self.state = state[order]
+        self.merged_cum = prefix_sum(self.merged)
+        self.offsets = np.searchsorted(self.author, np.arange(len(authors) + 1))
+
+        # Project wide, by closing time
+        self.by_closed = np.argsort(self.closed, kind='stable').astype(np.int32)
+        self.closed_sorted = self.closed[self.by_closed]
+        self.merged_sorted_cum = prefix_sum(self.merged[self.by_closed])
+
+    @classmethod
+    def from_db(cls) -> 'PrHistoryIndex':
+        with Session() as session:
+            rows = session.query(db_PR.number, db_PR.author, db_PR.state, db_PR.created, db_PR.closed, db_PR.merged).all()
+        return cls(rows)
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.number, self.author, self.created, self.closed, self.merged, self.state, self.merged_cum,
+                  self.offsets, self.by_closed, self.closed_sorted, self.merged_sorted_cum)
+        return sum(array.nbytes for array in arrays)
+
+    def author_slice(self, login: str) -> slice:
+        author_id = self.authors.get(login)
+        if author_id is None:
+            return slice(0, 0)
+        return slice(int(self.offsets[author_id]), int(self.offsets[author_id + 1]))
+
+    def author_total(self, login: str) -> int:
+        rows = self.author_slice(login)
+        return rows.stop - rows.start
+
+    # Closed and merged PRs of the author, closed within [start, end]
+    def author_window(self, login: str, start: datetime, end: datetime) -> tuple[int, int]:
+        rows = self.author_slice(login)
+        closed = self.closed[rows]
+        lo = rows.start + np.searchsorted(closed, epoch(start), side='left')
+        hi = rows.start + np.searchsorted(closed, epoch(end), side='right')
+        return int(hi - lo), int(self.merged_cum[hi] - self.merged_cum[lo])
+
+    def project_range(self, start: datetime, end: datetime) -> tuple[int, int]:
+        lo = np.searchsorted(self.closed_sorted, epoch(start), side='left')
+        hi = np.searchsorted(self.closed_sorted, epoch(end), side='right')
+        return int(lo), int(hi)
+
+    # Closed and merged PRs and distinct authors of the project, closed within [start, end]
+    def project_window(self, start: datetime, end: datetime) -> tuple[int, int, int]:
+        lo, hi = self.project_range(start, end)
+        authors = np.unique(self.author[self.by_closed[lo:hi]]).size
+        return hi - lo, int(self.merged_sorted_cum[hi] - self.merged_sorted_cum[lo]), int(authors)
+
+def prefix_sum(values: np.ndarray) -> np.ndarray:
+    result = np.zeros(len(values) + 1, dtype=np.int32)
+    np.cumsum(values, out=result[1:])
+    return result
+
+# Stored dates are naive UTC, GitHub dates are aware UTC
+def epoch(value: datetime) -> int:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+_index = None
+
+def load_history_index() -> PrHistoryIndex | None:
+    global _index
+
+    if USE_HISTORY_INDEX:
+        start_time = time.time()
+        _index = PrHistoryIndex.from_db()
+        print(f"\tHistory index: {len(_index.number)} PRs loaded in {time.time() - start_time}s ({_index.nbytes} bytes)")
+
+    return _index
+
+def get_history_index() -> PrHistoryIndex | None:
+    return _index
+
+# Queries of the features whose results differ from the per-PR SQL queries of the cache: author_window,
+# author_total and project_window over [at - window, at]
+def compare_with_sql(index: PrHistoryIndex, queries: list[tuple], window: timedelta) -> list:
+    mismatches = []
+
+    with Session() as session:
+        for key, author, at in queries:
+            time_limit = at - window
+            project_query = session.query(db_PR).filter(
+                db_PR.state == 'closed',
+                db_PR.closed <= at,
+                db_PR.closed >= time_limit,
+            )
+            author_query = project_query.where(db_PR.author == author)
+
+            expected = (
+                author_query.count(),
+                author_query.where(db_PR.merged).count(),
+                session.query(db_PR).where(db_PR.author == author).count(),
+                project_query.count(),
+                project_query.where(db_PR.merged).count(),
+                project_query.with_entities(db_PR.author).distinct().count(),
+            )
+            actual = (*index.author_window(author, time_limit, at), index.author_total(author), *index.project_window(time_limit, at))
+            if actual != expected:
+                mismatches.append(key)
+
+    return mismatches
+
+# Checks the index against the SQL queries on the local cache, or on a generated fixture
+#   python -m features.history_index
+#   python -m features.history_index --fixture 800
+if __name__ == '__main__':
+    import argparse
+    from features.config import HISTORY_RANGE_DAYS
+    from features.fixture import fixture_history, load_fixture
+
+    parser = argparse.ArgumentParser(description='Check the history index against the SQL queries')
+    parser.add_argument('--fixture', type=int, help='number of PRs of a generated history, instead of the local cache')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generated history')
+    args = parser.parse_args()
+
+    window = timedelta(days=HISTORY_RANGE_DAYS)
+    if args.fixture:
+        rows, queries = fixture_history(args.fixture, window, args.seed)
+        load_fixture(rows)
+    else:
+        with Session() as session:
+            queries = [(pr.number, pr.author, pr.created) for pr in session.query(db_PR)]
+
+    mismatches = compare_with_sql(PrHistoryIndex.from_db(), queries, window)
+    print(f"{len(queries) - len(mismatches)}/{len(queries)} queries match the SQL results")
+    if mismatches:
+        print(f"\tMismatches: {mismatches[:20]}")
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,80 @@
+import queue
+import zlib
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+from github import Github
+
+from features.budget import RunBudget
+from features.user_utils import api_copy
+from features.config import MAX_DATA_AGE, TTL_JITTER, STALE_WHILE_REVALIDATE, REFRESH_BUDGET
+from tracing import count
+
+EXPIRY_WINDOW = timedelta(days=MAX_DATA_AGE)
+
+# Cached entries expire after MAX_DATA_AGE +/- TTL_JITTER, spread by key (stable between runs)
+# so that the users cached on the same day don't all expire on the same day
+def expires_at(last_update: datetime, key: str) -> datetime:
+    spread = zlib.crc32(key.encode()) / 0xFFFFFFFF * 2 - 1
+    return last_update.replace(tzinfo=timezone.utc) + EXPIRY_WINDOW * (1 + TTL_JITTER * spread)
+
+# Stale-while-revalidate: expired entries are served as they are and refreshed by a background
+# thread while the stage goes on, at most REFRESH_BUDGET per stage and within the run budget (the
+# rest is refreshed by the next runs). The refreshes get the API of the thread, not the one of the stage.
+class Revalidator:
+    def __init__(self, name: str, api: Github, budget: RunBudget = None):
+        self.name = name
+        self.api = api
+        self.budget = budget
+        self.remaining = REFRESH_BUDGET
+        self.tasks = queue.Queue()
+        self.thread = None
+        self.submitted = set()
+
+    def enabled(self) -> bool:
+        return STALE_WHILE_REVALIDATE
+
+    def submit(self, key: str, refresh: Callable[[Github], None]) -> None:
+        # Already being refreshed
+        if key in self.submitted:
+            return
+
+        if self.remaining <= 0:
+            count('revalidate', f"{self.name}_deferred")
+            return
+
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.work, name=f"revalidate-{self.name}", daemon=True)
+            self.thread.start()
+
+        self.remaining -= 1
+        self.submitted.add(key)
+        self.tasks.put((key, refresh))
+
+    def work(self) -> None:
+        api = api_copy(self.api)
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+
+            key, refresh = task
+            if self.budget is not None and self.budget.exhausted():
+                count('revalidate', f"{self.name}_deferred")
+                continue
+
+            try:
+                refresh(api)
+                count('revalidate', f"{self.name}_refreshed")
+            except Exception as e:
+                # The stale entry stays cached and is retried next run
+                print(f"\tRefresh of {self.name} {key} failed: {e}")
+
+    def join(self) -> None:
+        if self.thread is None:
+            return
+
+        self.tasks.put(None)
+        self.thread.join()
+        self.thread = None
@@ -1,41 +1,131 @@
 import re
-from datetime import datetime
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
 
 from github import Github ,GithubException
+from github.GithubObject import GithubObject
 from github.NamedUser import NamedUser
 from github.PullRequest import PullRequest
 from github.Repository import Repository
+from sqlalchemy.dialects.sqlite import insert
 
-# TODO time execution
-def is_bot_user(user: NamedUser, repo: Repository) -> bool:
-    if user.type == 'Bot':
-        return True
+from db.db import Session, User
+from features.config import BOT_ALLOWLIST, BOT_DENYLIST
+from tracing import count
 
-    username = user.login
-    repo_name = repo.full_name.split('/')[1]
-    bot_tags = ['do not use', 'bot', 'chatbot', 'ci', 'jenkins', repo_name]
-    bot_pattern = r'(-|^|\b)({})(-|$|\b)'.format('|'.join(bot_tags))
-    bot_regex = re.compile(bot_pattern)
+# Bot classification built once per repository: precompiled name patterns, a per-login memo
+# preloaded from the users table (bot verdicts are persisted there) and configurable allow/deny lists.
+# The users table may be shared by several repositories, the logins matching the name of this repository
+# are bots of this repository only and are kept out of the memo.
+class BotDetector:
+    def __init__(self, repo_name: str):
+        bot_tags = ['do not use', 'bot', 'chatbot', 'ci', 'jenkins']
+        self.pattern = re.compile(r'(-|^|\b)({})(-|$|\b)'.format('|'.join(bot_tags)))
+        self.repo_pattern = re.compile(r'(-|^|\b)({})(-|$|\b)'.format(re.escape(repo_name.split('/')[-1])))
+        self.verdicts = None
+        self.new_bots = set()
 
-    if bot_regex.search(username):
-        return True
+    def load(self) -> None:
+        with Session() as session:
+            users = session.query(User.username, User.type).all()
+        self.verdicts = {username: user_type == 'bot' for username, user_type in users}
 
-    return False
+    def is_bot(self, user: NamedUser) -> bool:
+        login = user.login
 
-def is_user_reviewer(pr: PullRequest, user: NamedUser):
-    if user.login != pr.user.login:
-        # Check in requested list
-        for reviewer in pr.requested_reviewers:
-            if user.login == reviewer.login:
-                return True
+        if login.lower() in BOT_ALLOWLIST:
+            return False
+        if login.lower() in BOT_DENYLIST:
+            return True
+        if self.repo_pattern.search(login) is not None:
+            return True
 
-        # Check through reviews
-        reviews = pr.get_reviews()
-        for review in reviews:
-            if review.user.login == user.login:
-                return True
+        if self.verdicts is None:
+            self.load()
 
-    return False
+        verdict = self.verdicts.get(login)
+        if verdict is not None:
+            count('cache', 'bot_verdict_hit')
+            return verdict
+
+        # Name pattern first, the user type may require fetching the user
+        verdict = self.pattern.search(login) is not None or user.type == 'Bot'
+        self.verdicts[login] = verdict
+        if verdict:
+            self.new_bots.add(login)
+
+        return verdict
+
+    def save(self) -> None:
+        if not self.new_bots:
+            return
+
+        # Users already known (possibly through another repository) are left as they are
+        stmt = insert(User).values([{'username': login, 'type': 'bot'} for login in self.new_bots])
+        with Session() as session:
+            session.execute(stmt.on_conflict_do_nothing(index_elements=['username']))
+            session.commit()
+
+        self.new_bots.clear()
+
+# PyGithub keeps a single HTTP connection per Github instance (and the objects it returns), which must not
+# be used by two threads at once: every thread making API calls uses its own copy with the same settings
+def api_copy(source: Github | GithubObject) -> Github:
+    requester = source._Github__requester if isinstance(source, Github) else source._requester
+    return Github(**requester.kwargs)
+
+# Reviewer and requested reviewer logins of the closed PRs, resolved in one batched pass over the
+# history window (most recently updated first) so that "how many PRs did X review" needs no extra API calls
+class ReviewerIndex:
+    def __init__(self, repo: Repository):
+        # Own API connection, the index is scanned from several threads
+        pulls = api_copy(repo).get_repo(repo.full_name, lazy=True).get_pulls(state='closed', sort='updated', direction='desc')
+        self.pulls = iter(pulls)
+        self.scanned_until = None
+        self.closed = {}
+        self.by_login = defaultdict(set)
+        # The PR iterator is shared by the private reviewer workers and the revalidation thread
+        self.lock = threading.RLock()
+
+    def scan(self, since: datetime) -> None:
+        with self.lock:
+            # A PR closed after 'since' was also updated after it
+            while self.scanned_until is None or self.scanned_until >= since:
+                pr = next(self.pulls, None)
+                if pr is None:
+                    self.scanned_until = datetime.min.replace(tzinfo=timezone.utc)
+                    return
+
+                self.add(pr)
+                self.scanned_until = pr.updated_at
+
+    def add(self, pr: PullRequest) -> None:
+        count('reviewer_index', 'prs')
+        self.closed[pr.number] = pr.closed_at
+
+        logins = {reviewer.login for reviewer in pr.requested_reviewers}
+        logins.update(review.user.login for review in pr.get_reviews() if review.user is not None)
+        logins.discard(pr.user.login)
+
+        for login in logins:
+            self.by_login[login].add(pr.number)
+
+    # PRs closed within [start, end] reviewed by (or awaiting a review from) the user, excluding their own
+    def review_count(self, login: str, start: datetime, end: datetime) -> int:
+        with self.lock:
+            self.scan(start)
+            return sum(1 for number in self.by_login.get(login, ()) if start <= self.closed[number] <= end)
+
+# One index by repository, also created from the revalidation thread
+_reviewer_indexes = {}
+_reviewer_indexes_lock = threading.Lock()
+
+def get_reviewer_index(repo: Repository) -> ReviewerIndex:
+    with _reviewer_indexes_lock:
+        if repo.full_name not in _reviewer_indexes:
+            _reviewer_indexes[repo.full_name] = ReviewerIndex(repo)
+        return _reviewer_indexes[repo.full_name]
 
 # When trying to fetch private user data through issue search and exploring props
 # A code 422 exception is raised
@@ -0,0 +1,185 @@
+import os
+import sys
+import gzip
+import json
+import time
+import argparse
+from datetime import datetime, timezone
+from typing import Iterator
+
+import sqlalchemy as sa
+from dotenv import load_dotenv
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import sessionmaker
+
+from db.db import Session, init_db, PullRequest as db_PR
+from features.activity import rebuild_activity
+
+# Seeds the pull_requests table from an offline dump so that the first run doesn't have to page through
+# the whole PR history. Every PR is stored with the last update time of the dump (high-water mark), the
+# next run then only syncs the PRs updated since through the API.
+#
+#   python import_history.py prs.jsonl                JSONL export of a previous run (--export)
+#   python import_history.py 2024-*.json.gz           GHArchive hourly dumps, filtered on GITHUB_REPO
+#   python import_history.py other/cache.db           pull_requests table of another cache
+#   python import_history.py --export prs.jsonl       Exports the local cache
+
+# Rows per INSERT statement
+INSERT_BATCH = 10000
+
+COLUMNS = ['number', 'title', 'state', 'merged', 'author', 'created', 'closed', 'last_update']
+
+def main():
+    load_dotenv(override=True)
+
+    parser = argparse.ArgumentParser(description='Import the PR history of the cache from offline dumps')
+    parser.add_argument('sources', nargs='*', help='JSONL exports, GHArchive dumps (.json/.json.gz) or cache.db files')
+    parser.add_argument('--repo', default=os.environ.get('GITHUB_REPO'), help='owner/name, to filter GHArchive events')
+    parser.add_argument('--export', help='write the cached PR history to this JSONL file')
+    args = parser.parse_args()
+
+    if not args.sources and not args.export:
+        parser.error('nothing to import or export')
+
+    init_db(False)
+
+    for source in args.sources:
+        start_time = time.time()
+        imported = import_rows(read_source(source, args.repo))
+        print(f"\t{imported} PRs imported from {source} in {time.time() - start_time}s")
+
+    if args.sources:
+        with Session() as session:
+            rebuild_activity(session)
+            session.commit()
+            high_water_mark = session.query(func.max(db_PR.last_update)).scalar()
+        print(f"\tThe next run will sync the PRs updated since {high_water_mark}")
+
+    if args.export:
+        exported = export_jsonl(args.export)
+        print(f"\t{exported} PRs exported to {args.export}")
+
+def read_source(path: str, repo: str | None) -> Iterator[dict]:
+    with open(path, 'rb') as source:
+        header = source.read(16)
+
+    if header.startswith(b'SQLite format 3'):
+        return read_cache_db(path)
+
+    first = next(read_json_lines(path), None)
+    if first is not None and 'payload' in first:
+        if not repo:
+            sys.exit('GHArchive dumps need the repository name (--repo or GITHUB_REPO)')
+        return read_gharchive(path, repo)
+
+    return read_jsonl(path)
+
+def read_json_lines(path: str) -> Iterator[dict]:
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as lines:
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+
+def read_jsonl(path: str) -> Iterator[dict]:
+    for rec in read_json_lines(path):
+        yield {
+            'number': rec['number'],
+            'title': rec['title'],
+            'state': rec['state'],
+            'merged': bool(rec['merged']),
+            'author': rec['author'],
+            'created': parse_date(rec['created']),
+            'closed': parse_date(rec.get('closed')),
+            'last_update': parse_date(rec['last_update']),
+        }
+
+# PullRequestEvent payloads carry the full PR, the most recent event of every PR wins
+def read_gharchive(path: str, repo: str) -> Iterator[dict]:
+    latest = {}
+    for event in read_json_lines(path):
+        if event.get('type') != 'PullRequestEvent' or event.get('repo', {}).get('name', '').lower() != repo.lower():
+            continue
+
+        pr = event['payload']['pull_request']
+        # Same as the API sync, open drafts are left out
+        if pr['state'] == 'open' and pr.get('draft'):
+            continue
+
+        updated = parse_date(pr['updated_at'])
+        if pr['number'] in latest and latest[pr['number']]['last_update'] >= updated:
+            continue
+
+        latest[pr['number']] = {
+            'number': pr['number'],
+            'title': pr['title'],
+            'state': pr['state'],
+            'merged': bool(pr.get('merged') or pr.get('merged_at')),
+            'author': pr['user']['login'],
+            'created': parse_date(pr['created_at']),
+            'closed': parse_date(pr.get('closed_at')),
+            'last_update': updated,
+        }
+
+    return iter(latest.values())
+
+def read_cache_db(path: str) -> Iterator[dict]:
+    engine = sa.create_engine(f'sqlite:///{path}')
+    with sessionmaker(bind=engine)() as session:
+        for row in session.query(*[getattr(db_PR, column) for column in COLUMNS]).yield_per(INSERT_BATCH):
+            yield dict(zip(COLUMNS, row))
+    engine.dispose()
+
+# Bulk upsert, a PR already in the cache is only replaced by more recent data
+def import_rows(rows: Iterator[dict]) -> int:
+    # Core statement on the table, executemany skips the per-row ORM bookkeeping
+    table = db_PR.__table__
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['number'],
+        set_={column: stmt.excluded[column] for column in COLUMNS[1:]},
+        where=stmt.excluded.last_update > table.c.last_update,
+    )
+
+    imported = 0
+    batch = []
+    with Session() as session:
+        connection = session.connection()
+        for row in rows:
+            batch.append(row)
+            if len(batch) == INSERT_BATCH:
+                connection.execute(stmt, batch)
+                imported += len(batch)
+                batch = []
+
+        if batch:
+            connection.execute(stmt, batch)
+            imported += len(batch)
+        session.commit()
+
+    return imported
+
+def export_jsonl(path: str) -> int:
+    exported = 0
+    with Session() as session, open(path, 'w', encoding='utf-8') as output:
+        for row in session.query(*[getattr(db_PR, column) for column in COLUMNS]).yield_per(INSERT_BATCH):
+            output.write(json.dumps(dict(zip(COLUMNS, row)), default=format_date) + '\n')
+            exported += 1
+
+    return exported
+
+# Stored dates are naive UTC
+def parse_date(value: str | None) -> datetime | None:
+    if value is None:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def format_date(value: datetime) -> str:
+    return value.isoformat()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing as mp
+from multiprocessing.connection import wait
+
+from dotenv import load_dotenv
+
+from rate_scheduler import RateScheduler, install_scheduler
+from tracing import reset_trace, write_summary
+
+# Triage of several repositories in one run. Every repository keeps its own PR cache, while the users
+# (reviewer profiles and bot verdicts) are cached once for all of them, so that a user active in many
+# repositories is only looked up once. The repositories are extracted concurrently, their API requests
+# go through one rate-limit scheduler, and their features are combined into a single file.
+#
+#   python multi_repo.py owner/a owner/b
+#   python multi_repo.py --repos-file repos.txt      One owner/name per line
+#   GITHUB_REPOS=owner/a,owner/b python multi_repo.py
+
+CACHE_DIR = './caches'
+FEATURES_PATH = './features.json'
+MEDIANS_PATH = './feature_medians.json'
+
+# Repositories extracted at the same time
+REPO_PROCESSES = int(os.getenv('REPO_PROCESSES') or '4')
+
+# API requests in flight at the same time, all repositories included
+API_CONCURRENCY = int(os.getenv('API_CONCURRENCY') or '8')
+
+def main():
+    load_dotenv(override=True)
+
+    parser = argparse.ArgumentParser(description='Extract the PR features of several repositories')
+    parser.add_argument('repos', nargs='*', help='owner/name of the repositories')
+    parser.add_argument('--repos-file', help='file listing the repositories, one per line')
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help='directory of the repository caches and of the users cache')
+    parser.add_argument('--output', default=FEATURES_PATH, help='combined features file')
+    parser.add_argument('--medians', default=MEDIANS_PATH, help='combined feature medians file, by repository')
+    parser.add_argument('--processes', type=int, default=REPO_PROCESSES, help='repositories extracted at the same time')
+    parser.add_argument('--concurrency', type=int, default=API_CONCURRENCY, help='API requests in flight at the same time')
+    args = parser.parse_args()
+
+    repos = read_repos(args)
+    if not repos:
+        parser.error('no repositories (arguments, --repos-file or GITHUB_REPOS)')
+
+    os.makedirs(args.cache_dir, exist_ok=True)
+    reset_trace()
+
+    # Spawned, so that each process opens the caches of its repository
+    ctx = mp.get_context('spawn')
+    scheduler = RateScheduler(args.concurrency, ctx)
+
+    pending = list(repos)
+    running = {}
+    failed = []
+    while pending or running:
+        while pending and len(running) < args.processes:
+            repo = pending.pop(0)
+            # Read by db.db when the process imports it
+            os.environ['CACHE_DB'] = cache_path(args.cache_dir, repo, '.db')
+            os.environ['USERS_DB'] = os.path.join(args.cache_dir, 'users.db')
+
+            paths = (cache_path(args.cache_dir, repo, '.features.json'), cache_path(args.cache_dir, repo, '.medians.json'))
+            process = ctx.Process(target=run_repo, args=(repo, *paths, scheduler), name=repo)
+            process.start()
+            running[process.sentinel] = (repo, process)
+
+        for sentinel in wait(list(running)):
+            repo, process = running.pop(sentinel)
+            process.join()
+            if process.exitcode != 0:
+                print(f"\t{repo}: extraction failed (exit code {process.exitcode})")
+                failed.append(repo)
+
+    extracted = [repo for repo in repos if repo not in failed]
+    features = combine_features(extracted, args.cache_dir)
+    write_to_json(features, args.output)
+    write_to_json(combine_medians(extracted, args.cache_dir), args.medians)
+    print(f"\t{len(features)} PRs of {len(repos) - len(failed)} repositories written to {args.output}")
+
+    write_summary()
+
+    if failed:
+        sys.exit(f"Extraction failed for {', '.join(failed)}")
+
+def read_repos(args: argparse.Namespace) -> list[str]:
+    repos = list(args.repos)
+    if args.repos_file:
+        with open(args.repos_file, encoding='utf-8') as repos_file:
+            repos += [line.strip() for line in repos_file if line.strip() and not line.startswith('#')]
+    if not repos:
+        repos = [repo.strip() for repo in os.getenv('GITHUB_REPOS', '').split(',') if repo.strip()]
+
+    # Once each, in the given order
+    return list(dict.fromkeys(repos))
+
+def cache_path(cache_dir: str, repo: str, suffix: str) -> str:
+    return os.path.join(cache_dir, repo.replace('/', '__') + suffix)
+
+def run_repo(repo: str, features_path: str, medians_path: str, scheduler: RateScheduler) -> None:
+    # Imported here, the caches of the repository are opened at import
+    import extract
+    from tracing import install_tracing
+
+    install_tracing(extract.db, reset=False)
+    install_scheduler(scheduler)
+
+    start_time = time.time()
+    extract.run(repo, features_path, medians_path)
+    print(f"\t{repo}: features extracted in {time.time() - start_time}s")
+
+# One list for all the repositories, every PR tagged with its repository
+def combine_features(repos: list[str], cache_dir: str) -> list:
+    features = []
+    for repo in repos:
+        with open(cache_path(cache_dir, repo, '.features.json'), encoding='utf-8') as features_file:
+            for pr in json.load(features_file):
+                features.append({'repo': repo, **pr})
+
+    return features
+
+# Medians of each repository, the PRs are filled with the medians of their repository
+def combine_medians(repos: list[str], cache_dir: str) -> dict:
+    medians = {}
+    for repo in repos:
+        with open(cache_path(cache_dir, repo, '.medians.json'), encoding='utf-8') as medians_file:
+            medians[repo] = json.load(medians_file)
+
+    return medians
+
+def write_to_json(data: list | dict, path: str):
+    with open(path, "w", encoding="utf-8") as output_file:
+        json.dump(data, output_file, indent=2)
+
+if __name__ == '__main__':
+    main()
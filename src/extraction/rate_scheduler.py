@@ -0,0 +1,82 @@
+import os
+import time
+import multiprocessing as mp
+
+from github.Requester import Requester
+
+from tracing import TracedHTTPConnection, TracedHTTPSConnection, count
+
+# Rate-limit scheduler shared by the processes of a multi-repository run, which all use the same token:
+# bounds the number of API requests in flight and, once a rate-limit resource runs low, holds every
+# request to that resource until its reset instead of letting each process run into the limit
+
+# Fraction of each resource limit kept in reserve before its requests are held
+RATE_RESERVE = float(os.getenv('RATE_RESERVE') or '0.02')
+
+RESOURCES = ['core', 'search', 'graphql']
+
+def api_resource(url: str) -> str:
+    # Enterprise server paths are prefixed with /api/v3
+    path = url.split('?', 1)[0]
+    if '/search/' in path:
+        return 'search'
+    if path.endswith('/graphql'):
+        return 'graphql'
+    return 'core'
+
+class RateScheduler:
+    def __init__(self, concurrency: int, ctx=mp):
+        self.slots = ctx.BoundedSemaphore(concurrency)
+        # Reset time of the resources running low
+        self.resume_at = {resource: ctx.Value('d', 0.0) for resource in RESOURCES}
+
+    def acquire(self, resource: str) -> None:
+        wait = self.resume_at[resource].value - time.time()
+        if wait > 0:
+            count('rate_limit', 'scheduler_waits')
+            count('rate_limit', 'scheduler_wait_ms', int(wait * 1000))
+            time.sleep(wait)
+
+        self.slots.acquire()
+
+    def release(self, resource: str, headers) -> None:
+        self.slots.release()
+
+        remaining = headers.get('x-ratelimit-remaining')
+        limit = headers.get('x-ratelimit-limit')
+        reset = headers.get('x-ratelimit-reset')
+        if remaining is None or limit is None or reset is None:
+            return
+
+        resource = headers.get('x-ratelimit-resource', resource)
+        if resource in self.resume_at and int(remaining) <= int(limit) * RATE_RESERVE:
+            resume_at = self.resume_at[resource]
+            with resume_at.get_lock():
+                resume_at.value = max(resume_at.value, float(reset))
+
+_scheduler: RateScheduler = None
+
+class _ScheduledConnection:
+    def getresponse(self):
+        resource = api_resource(self.url)
+        _scheduler.acquire(resource)
+
+        response = None
+        try:
+            response = super().getresponse()
+            return response
+        finally:
+            _scheduler.release(resource, response.headers if response is not None else {})
+
+class ScheduledHTTPConnection(_ScheduledConnection, TracedHTTPConnection):
+    pass
+
+class ScheduledHTTPSConnection(_ScheduledConnection, TracedHTTPSConnection):
+    pass
+
+# Every API request of the process (and of its forked stage processes) goes through the scheduler
+def install_scheduler(scheduler: RateScheduler) -> None:
+    global _scheduler
+
+    _scheduler = scheduler
+    Requester.injectConnectionClasses(ScheduledHTTPConnection, ScheduledHTTPSConnection)
@@ -0,0 +1,137 @@
+import os
+import time
+import shutil
+import sqlite3
+import argparse
+
+import zstandard
+
+from db.db import SCHEMA_VERSION
+
+# Portable cache snapshots for the action cache: a consistent copy of cache.db without the tables
+# that every run rebuilds, VACUUMed and zstd compressed. Restoring checks the schema version (newer
+# snapshots are rejected, older ones are migrated by init_db) and the integrity of the database
+# before it replaces cache.db.
+#
+#   python snapshot.py save        cache.db -> cache.db.zst
+#   python snapshot.py restore     cache.db.zst -> cache.db
+#   python snapshot.py bench       Round-trip times and sizes, raw file vs snapshot
+
+CACHE_PATH = './cache.db'
+SNAPSHOT_PATH = './cache.db.zst'
+
+# Rebuilt or cleared by every run
+RECOMPUTABLE_TABLES = ['pr_text', 'pr_stale', 'project_activity']
+
+ZSTD_LEVEL = int(os.getenv('SNAPSHOT_LEVEL') or '10')
+
+def save(cache_path: str = CACHE_PATH, snapshot_path: str = SNAPSHOT_PATH) -> None:
+    compact_path = snapshot_path + '.tmp'
+
+    # Online backup, consistent even if the cache is in use
+    source = sqlite3.connect(cache_path)
+    compact = sqlite3.connect(compact_path)
+    source.backup(compact)
+    source.close()
+
+    existing = {name for (name,) in compact.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for table in RECOMPUTABLE_TABLES:
+        if table in existing:
+            compact.execute(f'DELETE FROM {table}')
+    compact.commit()
+    compact.execute('VACUUM')
+    compact.close()
+
+    compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=-1)
+    with open(compact_path, 'rb') as src, open(snapshot_path, 'wb') as dst:
+        compressor.copy_stream(src, dst)
+    os.remove(compact_path)
+
+def restore(snapshot_path: str = SNAPSHOT_PATH, cache_path: str = CACHE_PATH) -> bool:
+    restored_path = cache_path + '.tmp'
+
+    decompressor = zstandard.ZstdDecompressor()
+    try:
+        with open(snapshot_path, 'rb') as src, open(restored_path, 'wb') as dst:
+            decompressor.copy_stream(src, dst)
+        error = check(restored_path)
+    except zstandard.ZstdError as e:
+        error = str(e)
+
+    if error is not None:
+        print(f"\tSnapshot {snapshot_path} discarded: {error}")
+        os.remove(restored_path)
+        return False
+
+    os.replace(restored_path, cache_path)
+    return True
+
+def check(path: str) -> str | None:
+    try:
+        conn = sqlite3.connect(path)
+        try:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            integrity = conn.execute('PRAGMA quick_check').fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError as e:
+        return str(e)
+
+    # Older caches are migrated by init_db
+    if version > SCHEMA_VERSION:
+        return f"schema version {version}, this version of the action supports up to {SCHEMA_VERSION}"
+    if integrity != 'ok':
+        return f"integrity check failed ({integrity})"
+    return None
+
+def bench(cache_path: str = CACHE_PATH) -> None:
+    snapshot_path = cache_path + '.bench.zst'
+    restored_path = cache_path + '.bench'
+
+    # Raw file round trip, as previously cached
+    start_time = time.time()
+    shutil.copyfile(cache_path, restored_path)
+    raw_time = time.time() - start_time
+    os.remove(restored_path)
+
+    start_time = time.time()
+    save(cache_path, snapshot_path)
+    save_time = time.time() - start_time
+
+    start_time = time.time()
+    restore(snapshot_path, restored_path)
+    restore_time = time.time() - start_time
+
+    raw_size = os.path.getsize(cache_path)
+    snapshot_size = os.path.getsize(snapshot_path)
+    os.remove(snapshot_path)
+    os.remove(restored_path)
+
+    print('| | Size (MB) | Save (s) | Restore (s) |')
+    print('| --- | ---: | ---: | ---: |')
+    print(f"| raw cache.db | {raw_size / 1e6:.2f} | {raw_time:.2f} | {raw_time:.2f} |")
+    print(f"| snapshot | {snapshot_size / 1e6:.2f} | {save_time:.2f} | {restore_time:.2f} |")
+
+def main():
+    parser = argparse.ArgumentParser(description='Save and restore compressed cache snapshots')
+    parser.add_argument('command', choices=['save', 'restore', 'bench'])
+    parser.add_argument('--cache', default=CACHE_PATH, help='cache database path')
+    parser.add_argument('--snapshot', default=SNAPSHOT_PATH, help='snapshot path')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    match args.command:
+        case 'save':
+            save(args.cache, args.snapshot)
+            print(f"Snapshot {args.snapshot} saved ({os.path.getsize(args.snapshot)} bytes) in {time.time() - start_time}s")
+        case 'restore':
+            if not os.path.isfile(args.snapshot):
+                print(f"No snapshot at {args.snapshot}")
+            # A discarded snapshot leaves the cache to be filled from scratch
+            elif restore(args.snapshot, args.cache):
+                print(f"Snapshot {args.snapshot} restored in {time.time() - start_time}s")
+        case 'bench':
+            bench(args.cache)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+import os
+import re
+import json
+import time
+import functools
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from github import GithubRetry
+from github.Requester import Requester, HTTPRequestsConnectionClass, HTTPSRequestsConnectionClass
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Trace output, one JSON record per line (spans and counter flushes)
+TRACE_PATH = os.getenv('TRACE_PATH') or './trace.jsonl'
+
+# Number of rows shown per table in the run summary
+SUMMARY_TOP = 10
+
+# Per-process counters, flushed to the trace at the end of every stage
+counters: Counter = Counter()
+
+_trace_file = None
+_trace_pid = None
+
+def _write(record: dict) -> None:
+    global _trace_file, _trace_pid
+
+    # Stage processes are forked, each one needs its own handle
+    if _trace_file is None or _trace_pid != os.getpid():
+        _trace_file = open(TRACE_PATH, 'a', encoding='utf-8', buffering=1)
+        _trace_pid = os.getpid()
+
+    _trace_file.write(json.dumps(record, default=str) + '\n')
+
+def reset_trace() -> None:
+    if os.path.isfile(TRACE_PATH):
+        os.remove(TRACE_PATH)
+
+def count(group: str, name: str, n: int = 1) -> None:
+    counters[(group, name)] += n
+
+def flush_counters() -> None:
+    if not counters:
+        return
+
+    values = defaultdict(dict)
+    for (group, name), n in counters.items():
+        values[group][name] = n
+
+    _write({'type': 'counters', 'pid': os.getpid(), 'values': values})
+    counters.clear()
+
+# Pool workers start with a copy of the counters of their parent, which the parent flushes itself
+def init_worker() -> None:
+    counters.clear()
+
+@contextmanager
+def span(kind: str, name: str, **attrs):
+    start = time.time()
+    try:
+        yield
+    finally:
+        _write({
+            'type': 'span',
+            'kind': kind,
+            'name': name,
+            'pid': os.getpid(),
+            'start': start,
+            'duration': time.time() - start,
+            **attrs,
+        })
+
+def record_stage(name: str, start: float) -> None:
+    duration = time.time() - start
+    _write({'type': 'span', 'kind': 'stage', 'name': name, 'pid': os.getpid(), 'start': start, 'duration': duration})
+    flush_counters()
+    print(f"Step: \"{name}\" executed in {duration}s")
+
+def stage(name: str):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record_stage(name, start)
+        return wrapper
+    return decorator
+
+
+# GitHub API instrumentation
+def api_endpoint(url: str) -> str:
+    path = url.split('?', 1)[0]
+    path = re.sub(r'^/repos/[^/]+/[^/]+', '/repos/{repo}', path)
+    path = re.sub(r'^/users/[^/]+', '/users/{user}', path)
+    return re.sub(r'/\d+(?=/|$)', '/{n}', path)
+
+class _TracedConnection:
+    def getresponse(self):
+        endpoint = api_endpoint(self.url)
+        count('api_calls', endpoint)
+        with span('api', endpoint, verb=self.verb):
+            return super().getresponse()
+
+class TracedHTTPConnection(_TracedConnection, HTTPRequestsConnectionClass):
+    pass
+
+class TracedHTTPSConnection(_TracedConnection, HTTPSRequestsConnectionClass):
+    pass
+
+class TracedRetry(GithubRetry):
+    def sleep(self, response=None):
+        count('rate_limit', 'sleeps')
+        start = time.time()
+        try:
+            super().sleep(response)
+        finally:
+            count('rate_limit', 'sleep_ms', int((time.time() - start) * 1000))
+
+
+# SQL instrumentation
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    count('sql', 'queries')
+
+def _count_commit(conn):
+    count('sql', 'commits')
+
+# The processes of a multi-repository run append to the trace of the run
+def install_tracing(engine: Engine, reset: bool = True) -> None:
+    if reset:
+        reset_trace()
+    Requester.injectConnectionClasses(TracedHTTPConnection, TracedHTTPSConnection)
+    event.listen(engine, 'before_cursor_execute', _count_query)
+    event.listen(engine, 'commit', _count_commit)
+
+
+# Run summary
+def load_trace() -> list[dict]:
+    if not os.path.isfile(TRACE_PATH):
+        return []
+
+    with open(TRACE_PATH, encoding='utf-8') as trace:
+        return [json.loads(line) for line in trace if line.strip()]
+
+def build_summary(records: list[dict]) -> str:
+    stages = []
+    pr_times = Counter()
+    author_times = Counter()
+    totals = defaultdict(Counter)
+
+    for rec in records:
+        if rec['type'] == 'counters':
+            for group, values in rec['values'].items():
+                totals[group].update(values)
+        elif rec['kind'] == 'stage':
+            stages.append((rec['name'], rec['duration']))
+        elif rec['kind'] == 'pr':
+            pr_times[rec['number']] += rec['duration']
+            author_times[rec['author']] += rec['duration']
+
+    lines = ['## PR Triage run summary', '', '| Stage | Duration (s) |', '| --- | ---: |']
+    lines += [f"| {name} | {duration:.2f} |" for name, duration in stages]
+
+    lines += ['', '| Slowest PRs | Duration (s) |', '| --- | ---: |']
+    lines += [f"| #{number} | {duration:.2f} |" for number, duration in pr_times.most_common(SUMMARY_TOP)]
+
+    lines += ['', '| Slowest authors | Duration (s) |', '| --- | ---: |']
+    lines += [f"| {author} | {duration:.2f} |" for author, duration in author_times.most_common(SUMMARY_TOP)]
+
+    lines += ['', '| Counter | Value |', '| --- | ---: |']
+    for group in sorted(totals):
+        for name, n in totals[group].most_common():
+            lines.append(f"| {group}: `{name}` | {n} |")
+
+    return '\n'.join(lines) + '\n'
+
+def write_summary() -> None:
+    flush_counters()
+    summary = build_summary(load_trace())
+    print(summary)
+
+    # Shown on the workflow run page when running inside an action
+    summary_path = os.getenv('GITHUB_STEP_SUMMARY')
+    if summary_path:
+        with open(summary_path, 'a', encoding='utf-8') as output:
+            output.write(summary)
@@ -1,5 +1,7 @@
 import time
 
+from tracing import record_stage
+
 def time_exec(start: time, func_name: str) -> time:
-    print(f"Step: \"{func_name}\" executed in {time.time() - start} sec")
+    record_stage(func_name, start)
     return time.time()
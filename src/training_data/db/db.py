@@ -12,6 +12,19 @@ CACHE_RESET = os.environ.get("RESET_CACHE")
 db = sa.create_engine('sqlite:///training_data.db', echo=False)
 Session = sessionmaker(bind=db)
 
+# Median of the non-null values of a column (of a table or a subquery), computed by SQLite in one query
+def median(session, column) -> float | None:
+    values = sa.select(column.label('value')).where(column.is_not(None)).subquery()
+    ranked = sa.select(
+        values.c.value,
+        func.row_number().over(order_by=values.c.value).label('position'),
+        func.count().over().label('total')
+    ).subquery()
+
+    # Middle value, or mean of the two middle values
+    middle = sa.or_(ranked.c.position == (ranked.c.total + 1) // 2, ranked.c.position == (ranked.c.total + 2) // 2)
+    return session.execute(sa.select(func.avg(ranked.c.value)).where(middle)).scalar()
+
 def init_db() -> None:
     if CACHE_RESET == 'true':
         print('Cached db entries will be reset')
@@ -20,6 +33,10 @@ def init_db() -> None:
 
     Base.metadata.create_all(db)
 
+    # Indexes added after the creation of existing databases
+    for index in PrAuthor.__table__.indexes:
+        index.create(db, checkfirst=True)
+
 class Base(DeclarativeBase):
     pass
 
@@ -55,6 +72,8 @@ class PrReviewer(Base):
 
 class PrAuthor(Base):
     __tablename__ = 'pr_author'
+    # Averages of the public authors, for the private authors medians
+    __table_args__ = (sa.Index('ix_pr_author_type_username', 'type', 'username'),)
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     username: Mapped[str]
@@ -5,7 +5,7 @@ import time
 from dotenv import load_dotenv
 from github import Github, Auth, GithubRetry
 
-from db.db import Session, init_db, Project, PullRequest
+from db.db import Session, init_db, PullRequest, PrProject, PrAuthor, PrReviewers, PrText, PrCode
 from features.extractor import Extractor
 from utils import time_exec
 
@@ -56,11 +56,12 @@ def build_feature_dataset(repo: str):
     return features
 
 def build_pr_features(pr: PullRequest):
-    author_feat = pr.author_feat
-    reviewer_feat = pr.reviewer_feat
-    text_feat = pr.text_feat
-    code_feat = pr.code_feat
-    proj_feat = pr.project_feat
+    # PRs of an interrupted run may miss some features, which are left empty
+    author_feat = pr.author_feat or PrAuthor()
+    reviewer_feat = pr.reviewer_feat or PrReviewers()
+    text_feat = pr.text_feat or PrText()
+    code_feat = pr.code_feat or PrCode()
+    proj_feat = pr.project_feat or PrProject()
 
     return {
         'title': pr.title,
@@ -0,0 +1,70 @@
+import math
+from typing import Iterable
+
+from db.db import PrCode
+
+# Code features accumulated file by file, so that the changed files of a PR never have to be held in
+# memory: directories are deduplicated with sets and the entropy of the changes distribution is kept
+# as running sums, H = log2(S) - sum(c * log2(c)) / S where S is the sum of the file changes c
+class CodeStats:
+    # Without the PR line totals (git diff), every changed file counts for the entropy
+    def __init__(self, total_modified_lines: int | None = None):
+        self.total_modified_lines = total_modified_lines
+        self.files_added = 0
+        self.files_deleted = 0
+        self.files_modified = 0
+        self.lines_added = 0
+        self.lines_deleted = 0
+        self.top_dirs = set()
+        self.bottom_dirs = set()
+        self.changes_sum = 0
+        self.changes_log_sum = 0.0
+
+    def add(self, file_path: str, status: str, additions: int, deletions: int) -> None:
+        changes = additions + deletions
+        self.lines_added += additions
+        self.lines_deleted += deletions
+
+        # Modified directories/subsystems
+        if '/' in file_path:
+            self.top_dirs.add(file_path.split('/', 1)[0])
+            self.bottom_dirs.add(file_path.rsplit('/', 1)[0])
+
+        # Changes distribution for entropy
+        if changes > 0 and (self.total_modified_lines is None or self.total_modified_lines > 0):
+            self.changes_sum += changes
+            self.changes_log_sum += changes * math.log2(changes)
+
+        # File changes
+        match status:
+            case "added":
+                self.files_added += 1
+            case "removed":
+                self.files_deleted += 1
+            case "modified" | "renamed" | "changed":
+                self.files_modified += 1
+
+    def add_all(self, files: Iterable[tuple[str, str, int, int]]) -> 'CodeStats':
+        for file_path, status, additions, deletions in files:
+            self.add(file_path, status, additions, deletions)
+        return self
+
+    @property
+    def entropy(self) -> float:
+        if self.changes_sum == 0:
+            return 0
+        return max(math.log2(self.changes_sum) - self.changes_log_sum / self.changes_sum, 0.0)
+
+    # Line totals default to the sum over the scanned files
+    def to_feature(self, pr_num: int, lines_added: int = None, lines_deleted: int = None) -> PrCode:
+        return PrCode(
+            num_of_directory = len(self.bottom_dirs),
+            modify_entropy = self.entropy,
+            lines_added = self.lines_added if lines_added is None else lines_added,
+            lines_deleted = self.lines_deleted if lines_deleted is None else lines_deleted,
+            files_added = self.files_added,
+            files_deleted = self.files_deleted,
+            files_modified = self.files_modified,
+            subsystem_num = len(self.top_dirs),
+            pr_num = pr_num
+        )
@@ -19,4 +19,13 @@ DATETIME_NOW = datetime.now(timezone.utc)
 
 # DB Preload Config
 LOAD_PRS = 100
-LOAD_PROCESSES = int(os.getenv('PREFILL_PROCESSES') or '2')
\ No newline at end of file
+LOAD_PROCESSES = int(os.getenv('PREFILL_PROCESSES') or '2')
+
+# Feature rows written per transaction by the feature stages
+WRITE_CHUNK_SIZE = int(os.getenv('WRITE_CHUNK') or '500')
+
+# Title keywords flagging documentation and bug fixing PRs (documentation takes precedence), comma separated
+DEFAULT_DOC_KEYWORDS = 'doc,docs,documentation,readme,license,copyright'
+DEFAULT_BUG_KEYWORDS = 'bug,fix,repair,defect'
+DOC_KEYWORDS = [word.strip() for word in (os.getenv('DOC_KEYWORDS') or DEFAULT_DOC_KEYWORDS).split(',') if word.strip()]
+BUG_KEYWORDS = [word.strip() for word in (os.getenv('BUG_KEYWORDS') or DEFAULT_BUG_KEYWORDS).split(',') if word.strip()]
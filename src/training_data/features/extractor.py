@@ -33,7 +33,7 @@ class Extractor:
         self.db_cleanup(pull_requests)
 
         # Calc missing features
-        project_features(self.repo)
+        project_features(self.api, pull_requests)
         text_features(pull_requests)
         code_features(pull_requests)
         reviewer_features(self.api, pull_requests)
@@ -1,14 +1,15 @@
 import time
 from datetime import datetime, timedelta, timezone
-from statistics import median
 
 from github import Github
 from github.NamedUser import NamedUser
 from github.PullRequest import PullRequest
 from github.Repository import Repository
-from sqlalchemy import func
+from sqlalchemy import func, update
 
-from db.db import Session, PrAuthor, PullRequest as db_PR
+from db.db import Session, median, PrAuthor
+from features.sweep import HistorySweep, PointInTime
+from features.writer import FeatureWriter
 from features.user_utils import is_bot_user, is_user_reviewer, try_get_total_prs, try_get_reviews_num
 from features.config import HISTORY_RANGE_DAYS, DAYS_PER_YEAR, DEFAULT_MERGE_RATIO, DATETIME_NOW
 
@@ -17,10 +18,17 @@ HISTORY_WINDOW = timedelta(days=HISTORY_RANGE_DAYS)
 def author_features(api: Github, prs: list[PullRequest]) -> None:
     start_time = time.time()
 
-    for pr in prs:
-        step_time = time.time()
-        extract_author_feature(api, pr)
-        print(f"\tPR({pr.number}): {pr.title} | {time.time() - step_time}s")
+    # Project history of every PR author at PR creation, in a single pass
+    sweep = HistorySweep.from_db()
+    history = sweep.run([(pr.number, pr.user.login, pr.created_at) for pr in prs], HISTORY_WINDOW)
+    print(f"History sweep done in {time.time() - start_time}s")
+
+    with FeatureWriter() as writer:
+        for pr in prs:
+            step_time = time.time()
+            extract_author_feature(api, pr, sweep, history[pr.number], writer)
+            print(f"\tPR({pr.number}): {pr.title} | {time.time() - step_time}s")
+    print(f"\t{writer.written} author features written in {writer.commits} transactions")
 
     # Assign private user features based on median
     step_time = time.time()
@@ -29,7 +37,7 @@ def author_features(api: Github, prs: list[PullRequest]) -> None:
 
     print(f"Step: \"Author Features\" executed in {time.time() - start_time}s")
 
-def extract_author_feature(api: Github, pr: PullRequest):
+def extract_author_feature(api: Github, pr: PullRequest, sweep: HistorySweep, hist: PointInTime, writer: FeatureWriter):
     author = pr.user
     repo = pr.base.repo
     pr_creation = pr.created_at
@@ -39,13 +47,16 @@ def extract_author_feature(api: Github, pr: PullRequest):
         author_feat_pr = session.query(PrAuthor).where(PrAuthor.pr_num == pr.number).one_or_none()
         author_feat_sim = session.query(PrAuthor).where(PrAuthor.username == author.login).where(PrAuthor.pr_date == pr_creation.date()).first()
 
+    # Or from the rows not written yet
+    author_feat_sim = author_feat_sim or writer.find(PrAuthor, username=author.login, pr_date=pr_creation.date())
+
     # Return if info present
     if author_feat_pr or author_feat_sim:
         if author_feat_pr: 
             return
 
         if author_feat_sim:
-            create_from_similar(pr, author_feat_sim)
+            writer.add(create_from_similar(pr, author_feat_sim))
             return
 
     # Experience
@@ -57,37 +68,22 @@ def extract_author_feature(api: Github, pr: PullRequest):
     user_type = author_feat_pr.type if author_feat_pr else None
     match(user_type):
         case 'bot':
-            author_feats = bot_author_features(repo, author, pr_creation)
+            author_feats = bot_author_features(repo, author, sweep, hist)
         case 'private':
-            author_feats = private_author_features(repo, author, pr_creation)
+            author_feats = private_author_features(hist)
         case _:
-            author_feats = unknown_user_features(api, repo, author, pr_creation)
+            author_feats = unknown_user_features(api, repo, author, pr_creation, sweep, hist)
 
     # Save/Update session
-    create_from_feats(pr, author_feats, experience)
+    writer.add(create_from_feats(pr, author_feats, experience))
 
 
-def bot_author_features(repo: Repository, author: NamedUser, fr_date: datetime):
-    time_limit = fr_date - HISTORY_WINDOW
-    author_name = author.login
-
+def bot_author_features(repo: Repository, author: NamedUser, sweep: HistorySweep, hist: PointInTime):
     # closed/merged/total_changes
-    with Session() as session:
-        query = session.query(db_PR).filter(
-            db_PR.author == author.login,
-            db_PR.state == 'closed',
-            db_PR.closed <= fr_date,
-            db_PR.closed >= time_limit,
-        )
-        closed_prs = query.count()
-        merged_prs = query.where(db_PR.merged).count()
-        total_change_number = session.query(db_PR).where(db_PR.author == author_name).count()
-        rev_pr_nums = session.query(db_PR.number).filter(
-            db_PR.state == 'closed',
-            db_PR.closed <= fr_date,
-            db_PR.closed >= time_limit,
-        ).all()
-        rev_pr_nums = [pr.number for pr in rev_pr_nums]
+    closed_prs = hist.author_closed
+    merged_prs = hist.author_merged
+    total_change_number = hist.author_total
+    rev_pr_nums = sweep.window_numbers(hist)
 
     # review_num
     review_number = 0
@@ -114,21 +110,11 @@ def bot_author_features(repo: Repository, author: NamedUser, fr_date: datetime):
         'project_merge_ratio': project_merge_ratio,
     }
 
-def private_author_features(repo: Repository, author: NamedUser, fr_date: datetime):
-    # Merge ratios
-    time_limit = fr_date - HISTORY_WINDOW
-
+def private_author_features(hist: PointInTime):
     # Author project merge ratio
-    with Session() as session:
-        query = session.query(db_PR).filter(
-            db_PR.author == author.login,
-            db_PR.state == 'closed',
-            db_PR.closed <= fr_date,
-            db_PR.closed >= time_limit,
-        )
-        closed_pr_num = query.count()
-        merged_pr_num = query.where(db_PR.merged).count()
-        
+    closed_pr_num = hist.author_closed
+    merged_pr_num = hist.author_merged
+
     global_merge_ratio = DEFAULT_MERGE_RATIO
     if closed_pr_num > 0:
         project_merge_ratio = merged_pr_num / closed_pr_num
@@ -145,54 +131,42 @@ def private_author_features(repo: Repository, author: NamedUser, fr_date: dateti
     }
 
 def refresh_private_depended_stats():
-    change_number = []
-    review_number = []
-    changes_per_week = []
-
     with Session() as session:
         pub_authors = session.query(
             PrAuthor.username,
             func.avg(PrAuthor.total_change_number).label('avg_change_number'),
             func.avg(PrAuthor.review_number).label('avg_review_number'),
             func.avg(PrAuthor.changes_per_week).label('avg_changes_per_week')
-        ).where(PrAuthor.type == 'public').group_by(PrAuthor.username).all()
-
-    if len(pub_authors) > 0:
-        for author in pub_authors:
-            change_number.append(author.avg_change_number)
-            review_number.append(author.avg_review_number)
-            changes_per_week.append(author.avg_changes_per_week)
-
-        change_number = median(change_number) if len(change_number) > 0 else 0
-        review_number = median(review_number) if len(review_number) > 0 else 0
-        changes_per_week = median(changes_per_week) if len(changes_per_week) > 0 else 0
-    else:
-        change_number = 0
-        review_number = 0
-        changes_per_week = 0
-
-    with Session() as session:
-        priv_authors = session.query(PrAuthor).where(PrAuthor.type == 'private').all()
-        for author in priv_authors:
-            author.total_change_number = change_number
-            author.review_number = review_number
-            author.changes_per_week = changes_per_week
+        ).where(PrAuthor.type == 'public').group_by(PrAuthor.username).subquery()
+
+        # Medians of the public authors computed by SQLite, 0 without public authors
+        change_number = median(session, pub_authors.c.avg_change_number) or 0
+        review_number = median(session, pub_authors.c.avg_review_number) or 0
+        changes_per_week = median(session, pub_authors.c.avg_changes_per_week) or 0
+
+        session.execute(
+            update(PrAuthor).where(PrAuthor.type == 'private').values(
+                total_change_number=change_number,
+                review_number=review_number,
+                changes_per_week=changes_per_week,
+            )
+        )
         session.commit()
 
-def unknown_user_features(api: Github, repo: Repository, author: NamedUser, fr_date: datetime):
+def unknown_user_features(api: Github, repo: Repository, author: NamedUser, fr_date: datetime, sweep: HistorySweep, hist: PointInTime):
     author_name = author.login
     time_limit = fr_date - HISTORY_WINDOW
 
     # Detect bot user
     if is_bot_user(author, repo):
-        return bot_author_features(repo, author, fr_date)
+        return bot_author_features(repo, author, sweep, hist)
 
     # Total changes created
     total_change_number = try_get_total_prs(author, api)
 
     # Detect private user (if private, a 422 error was thrown in try_get_total_prs)
     if total_change_number is None:
-        return private_author_features(repo, author, fr_date)
+        return private_author_features(hist)
 
     # Reviews
     review_number = try_get_reviews_num(author_name, time_limit, fr_date, api)
@@ -210,15 +184,8 @@ def unknown_user_features(api: Github, repo: Repository, author: NamedUser, fr_d
         global_merge_ratio = global_pr_merged /global_pr_closed
 
         # Author project merge ratio
-        with Session() as session:
-            query = session.query(db_PR).filter(
-                db_PR.author == author_name,
-                db_PR.state == 'closed',
-                db_PR.closed <= fr_date,
-                db_PR.closed >= time_limit,
-            )
-            proj_closed_pulls = query.count()
-            proj_merged_pulls = query.where(db_PR.merged).count()
+        proj_closed_pulls = hist.author_closed
+        proj_merged_pulls = hist.author_merged
 
         if proj_closed_pulls == 0:
             project_merge_ratio = DEFAULT_MERGE_RATIO
@@ -234,36 +201,30 @@ def unknown_user_features(api: Github, repo: Repository, author: NamedUser, fr_d
         'project_merge_ratio': project_merge_ratio,
     }
 
-def create_from_feats(pr: PullRequest, feats: dict, experience: float):
-    with Session() as session:
-        author_feat = PrAuthor(
-            username=pr.user.login,
-            type = feats['type'],
-            experience=experience,
-            review_number=feats['review_number'],
-            total_change_number = feats['total_change_number'],
-            changes_per_week = feats['changes_per_week'],
-            global_merge_ratio = feats['global_merge_ratio'],
-            project_merge_ratio = feats['project_merge_ratio'],
-            pr_date = pr.created_at.date(),
-            pr_num = pr.number,
-        )
-        session.add(author_feat)
-        session.commit()
-
-def create_from_similar(pr: PullRequest, copy: PrAuthor):
-    with Session() as session:
-        author_feat = PrAuthor(
-                username=copy.username,
-                type = copy.type,
-                experience=copy.experience,
-                review_number=copy.review_number,
-                total_change_number = copy.total_change_number,
-                changes_per_week = copy.changes_per_week,
-                global_merge_ratio = copy.global_merge_ratio,
-                project_merge_ratio = copy.project_merge_ratio,
-                pr_date = pr.created_at.date(),
-                pr_num = pr.number,
-            )
-        session.add(author_feat)
-        session.commit()
+def create_from_feats(pr: PullRequest, feats: dict, experience: float) -> PrAuthor:
+    return PrAuthor(
+        username=pr.user.login,
+        type = feats['type'],
+        experience=experience,
+        review_number=feats['review_number'],
+        total_change_number = feats['total_change_number'],
+        changes_per_week = feats['changes_per_week'],
+        global_merge_ratio = feats['global_merge_ratio'],
+        project_merge_ratio = feats['project_merge_ratio'],
+        pr_date = pr.created_at.date(),
+        pr_num = pr.number,
+    )
+
+def create_from_similar(pr: PullRequest, copy: PrAuthor) -> PrAuthor:
+    return PrAuthor(
+        username=copy.username,
+        type = copy.type,
+        experience=copy.experience,
+        review_number=copy.review_number,
+        total_change_number = copy.total_change_number,
+        changes_per_week = copy.changes_per_week,
+        global_merge_ratio = copy.global_merge_ratio,
+        project_merge_ratio = copy.project_merge_ratio,
+        pr_date = pr.created_at.date(),
+        pr_num = pr.number,
+    )
@@ -1,97 +1,34 @@
 import time
-from datetime import timezone
-from scipy.stats import entropy
+from datetime import datetime, timezone
 from github.PullRequest import PullRequest
 
 from db.db import Session, PrCode
+from features.code_stats import CodeStats
+from features.writer import FeatureWriter
 
 def code_features(prs:list[PullRequest]):
     start_time = time.time()
 
-    for pr in prs:
-        extract_code_feature(pr)
-
-    print(f"Step: \"Code Features\" executed in {time.time() - start_time}s")
-
-
-def extract_code_feature(pr: PullRequest) -> PrCode:
-    # Try retrieve from cache
+    # Update time of the cached features, in one query
     with Session() as session:
-        code_feat = session.query(PrCode).where(PrCode.pr_num == pr.number).one_or_none()
-
-    if code_feat is not None:
-        last_update = code_feat.last_update.replace(tzinfo=timezone.utc)
-        if pr.updated_at < last_update:
-            return
-        else:
-          with Session() as session:
-            session.delete(code_feat)
-            session.commit()
-
-    # Features
-    modified_directories = 0
-    modify_entropy = 0
-    lines_added = pr.additions
-    lines_deleted = pr.deletions
-    files_modified = 0
-    files_added = 0
-    files_deleted = 0
-    subsystem_num = 0
+        cached = dict(session.query(PrCode.pr_num, PrCode.last_update).all())
 
-    # Temp vars
-    top_dir_changed = []
-    bot_dir_changes = []
-    entropy_pks = []
-    total_modified_lines = lines_added + lines_deleted
+    with FeatureWriter() as writer:
+        for pr in prs:
+            extract_code_feature(pr, writer, cached.get(pr.number))
+    print(f"\t{writer.written} code features written in {writer.commits} transactions")
 
-    # Scan changed files
-    files = list(pr.get_files())
-    for file in files:
-        # Modified directories/subsystems
-        file_path = file.filename
-        split_path = file_path.split("/")
-
-        if len(split_path) > 1:
-            top = split_path[0]
-            bottom = file_path.rsplit('/', 1)[0]
-
-            if top_dir_changed.count(top) == 0:
-                top_dir_changed.append(top)
-
-            if bot_dir_changes.count(bottom) == 0:
-                bot_dir_changes.append(bottom)
-
-        # PK ratio for entropy
-        if total_modified_lines > 0 and file.changes > 0:
-            file_pk = file.changes / total_modified_lines
-            entropy_pks.append(file_pk)
+    print(f"Step: \"Code Features\" executed in {time.time() - start_time}s")
 
-        # File changes
-        match file.status:
-            case "added":
-                files_added += 1
-            case "removed":
-                files_deleted += 1
-            case "modified" | "renamed" | "changed":
-                files_modified += 1
 
-    # Feature calc:
-    modified_directories = len(bot_dir_changes)
-    subsystem_num = len(top_dir_changed)
-    modify_entropy = entropy(entropy_pks, base=2) if len(entropy_pks) > 0 else 0
+def extract_code_feature(pr: PullRequest, writer: FeatureWriter, last_update: datetime | None) -> None:
+    if last_update is not None:
+        if pr.updated_at < last_update.replace(tzinfo=timezone.utc):
+            return
 
-    code_feat = PrCode(
-        num_of_directory = modified_directories,
-        modify_entropy = modify_entropy,
-        lines_added = lines_added,
-        lines_deleted = lines_deleted,
-        files_added = files_added,
-        files_deleted = files_deleted,
-        files_modified = files_modified,
-        subsystem_num = subsystem_num,
-        pr_num = pr.number
-    )
+    # Scan changed files, page by page
+    stats = CodeStats(pr.additions + pr.deletions)
+    stats.add_all((file.filename, file.status, file.additions, file.deletions) for file in pr.get_files())
 
-    with Session() as session:
-        session.add(code_feat)
-        session.commit()
+    # Replaces the outdated features (if any) when written
+    writer.add(stats.to_feature(pr.number, pr.additions, pr.deletions), replace=last_update is not None)
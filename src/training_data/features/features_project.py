@@ -1,10 +1,11 @@
 import time
-from datetime import timedelta, timezone
+from datetime import timedelta
 
 from github import Github
 from github.PullRequest import PullRequest
-from db.db import Session, PrProject, PullRequest as db_PR
-from features.config import HISTORY_RANGE_DAYS, MAX_DATA_AGE, DATETIME_NOW
+from db.db import Session, PrProject
+from features.config import HISTORY_RANGE_DAYS
+from features.sweep import HistorySweep
 
 HISTORY_WINDOW = timedelta(days=HISTORY_RANGE_DAYS)
 DEFAULT_MERGE_RATIO = 0.5
@@ -12,51 +13,27 @@ DEFAULT_MERGE_RATIO = 0.5
 def project_features(api: Github, prs: list[PullRequest]) -> None:
     start_time = time.time()
 
-    for pr in prs:
-        extract_project_feature(pr)
-
-    print(f"Step: \"Author Features\" executed in {time.time() - start_time}s")
-
-def extract_project_feature(pr: PullRequest) -> None:
-    start_time = time.time()
-
-    # Try retrieve from cache
     with Session() as session:
         # Previously calculated metrics
-        proj_feat_pr = session.query(PrProject).where(PrProject.pr_num == pr.number).one_or_none()
-        if proj_feat_pr:
-            return
+        done = {num for (num,) in session.query(PrProject.pr_num).all()}
 
-        # Metrics for PRs closed the same day
-        sim_prs = session.query(db_PR).where(db_PR.closed == pr.closed_at.date()).all()
-        for sim_pr in sim_prs:
-            if sim_pr.project_feat:
-                sim_feat = sim_pr.project_feat
-                with Session() as session:
-                    feats = PrProject(
-                        changes_per_week = sim_feat.changes_per_week,
-                        changes_per_author = sim_feat.changes_per_author,
-                        merge_ratio = sim_feat.merge_ratio
-                    )
-                    session.add(feats)
-                    session.commit()
-                return
+    # Project history at every PR closure, in a single sweep
+    pending = [pr for pr in prs if pr.number not in done]
+    history = HistorySweep.from_db().run([(pr.number, pr.user.login, pr.closed_at) for pr in pending], HISTORY_WINDOW)
 
-    # Latest N-day window
-    closure_date = pr.closed_at
-    time_limit = closure_date - HISTORY_WINDOW
+    project_feats = []
+    for pr in pending:
+        hist = history[pr.number]
+        project_feats.append(build_project_feature(pr, hist.project_closed, hist.project_merged, hist.project_authors))
 
-    # Merge ratio and weekly metrics
+    # Cache results
     with Session() as session:
-        query = session.query(db_PR).filter(
-            db_PR.state == 'closed',
-            db_PR.closed <= closure_date,
-            db_PR.closed >= time_limit,
-        )
-        closed_prs = query.count()
-        merged_prs = query.where(db_PR.merged).count()
-        pr_authors = query.with_entities(db_PR.author).distinct().count()
+        session.add_all(project_feats)
+        session.commit()
 
+    print(f"Step: \"Project Features\" executed in {time.time() - start_time}s")
+
+def build_project_feature(pr: PullRequest, closed_prs: int, merged_prs: int, pr_authors: int) -> PrProject:
     if closed_prs == 0:
         changes_per_author = 0
         changes_per_week = 0
@@ -66,15 +43,9 @@ def extract_project_feature(pr: PullRequest) -> None:
         changes_per_week = closed_prs * (7/HISTORY_RANGE_DAYS)
         merge_ratio = merged_prs / closed_prs
 
-    # Cache results
-    with Session() as session:
-        feats = PrProject(
-            changes_per_week = changes_per_week,
-            changes_per_author = changes_per_author,
-            merge_ratio = merge_ratio
-        )
-
-        session.add(feats)
-        session.commit()
-        
-    print(f"Step: \"Project Features\" executed in {time.time() - start_time}s")
+    return PrProject(
+        changes_per_week = changes_per_week,
+        changes_per_author = changes_per_author,
+        merge_ratio = merge_ratio,
+        pr_num = pr.number
+    )
@@ -9,21 +9,22 @@ from db.db import Session, PrReviewer, PrReviewers
 
 from features.user_utils import is_bot_user, is_user_reviewer, try_get_reviews_num
 from features.config import HISTORY_RANGE_DAYS, DAYS_PER_YEAR, DATETIME_NOW
+from features.writer import FeatureWriter
 
 HISTORY_WINDOW = timedelta(days=HISTORY_RANGE_DAYS)
 
 def reviewer_features(api: Github, prs: list[PullRequest]):
     start_time = time.time()
 
-    reviewer_feats = [extract_reviewer_feature(api, pr) for pr in prs]
-
-    with Session() as session:
-        session.add_all(reviewer_feats)
-        session.commit()
+    # Reviewer profiles as they are computed, then the features of every PR
+    with FeatureWriter() as writer:
+        reviewer_feats = [extract_reviewer_feature(api, pr, writer) for pr in prs]
+        writer.add_all(reviewer_feats)
+    print(f"\t{writer.written} reviewer rows written in {writer.commits} transactions")
 
     print(f"Step: \"Reviewer Features\" executed in {time.time() - start_time}s")
 
-def extract_reviewer_feature(api: Github, pr: PullRequest):
+def extract_reviewer_feature(api: Github, pr: PullRequest, writer: FeatureWriter):
     # Temp data
     requested_reviewers = pr.requested_reviewers
     repo = pr.base.repo
@@ -40,7 +41,7 @@ def extract_reviewer_feature(api: Github, pr: PullRequest):
             bot_reviewers += 1
         else:
             human_reviewers += 1
-            exp, revs = get_reviewer_feats(pr, repo, reviewer, api)
+            exp, revs = get_reviewer_feats(pr, repo, reviewer, api, writer)
             total_reviewer_experience += exp
             total_reviewer_review_num += revs
 
@@ -53,7 +54,7 @@ def extract_reviewer_feature(api: Github, pr: PullRequest):
             bot_reviewers += 1
         else:
             human_reviewers += 1
-            exp, revs = get_reviewer_feats(pr, repo, reviewer, api)
+            exp, revs = get_reviewer_feats(pr, repo, reviewer, api, writer)
             total_reviewer_experience += exp
             total_reviewer_review_num += revs
 
@@ -73,7 +74,7 @@ def extract_reviewer_feature(api: Github, pr: PullRequest):
         pr_num = pr.number
     )
 
-def get_reviewer_feats(pull: PullRequest, repo: Repository, user: NamedUser, api: Github):
+def get_reviewer_feats(pull: PullRequest, repo: Repository, user: NamedUser, api: Github, writer: FeatureWriter):
     username = user.login
     user_type = 'public'
     close_date = pull.closed_at
@@ -82,6 +83,9 @@ def get_reviewer_feats(pull: PullRequest, repo: Repository, user: NamedUser, api
     with Session() as session:
         db_user = session.query(PrReviewer).where(PrReviewer.username == username).where(PrReviewer.pr_date == close_date.date()).first()
 
+    # Or from the rows not written yet
+    db_user = db_user or writer.find(PrReviewer, username=username, pr_date=close_date.date())
+
     if db_user is not None:
         return db_user.experience, db_user.review_number
 
@@ -105,9 +109,6 @@ def get_reviewer_feats(pull: PullRequest, repo: Repository, user: NamedUser, api
             if is_user_reviewer(pr, user):
                 reviews += 1
 
-    with Session() as session:
-        db_user = PrReviewer(username=username, type=user_type, experience=experience, review_number=reviews, pr_date=close_date.date())
-        session.add(db_user)
-        session.commit()
+    writer.add(PrReviewer(username=username, type=user_type, experience=experience, review_number=reviews, pr_date=close_date.date()))
 
     return experience, reviews
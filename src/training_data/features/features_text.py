@@ -1,8 +1,25 @@
 import re
+import sys
 import time
 
 from github.PullRequest import PullRequest
 from db.db import Session, PrText
+from features.config import DOC_KEYWORDS, BUG_KEYWORDS, DEFAULT_DOC_KEYWORDS, DEFAULT_BUG_KEYWORDS
+
+# Number of PRs whose text features are computed and stored together
+TEXT_BATCH_SIZE = 500
+
+WORD_PATTERN = re.compile(r'\w+')
+
+# One alternation per category, a keyword matches on its own or wrapped in brackets/parentheses or followed by ':'
+def keyword_pattern(keywords: list[str]) -> re.Pattern | None:
+    if not keywords:
+        return None
+    alternation = '|'.join(re.escape(word) for word in keywords)
+    return re.compile(rf'(\b|\(|\[)(?:{alternation})(\b|\)|\]|:)', re.IGNORECASE)
+
+DOC_PATTERN = keyword_pattern(DOC_KEYWORDS)
+BUG_PATTERN = keyword_pattern(BUG_KEYWORDS)
 
 def text_features(prs: list[PullRequest]) -> PrText:
     start_time = time.time()
@@ -12,43 +29,37 @@ def text_features(prs: list[PullRequest]) -> PrText:
         session.query(PrText).delete()
         session.commit()
 
-    text_feats = [extract_text_feature(pr) for pr in prs]
+    for i in range(0, len(prs), TEXT_BATCH_SIZE):
+        text_feats = extract_text_features(prs[i:i + TEXT_BATCH_SIZE])
 
-    with Session() as session:
-        session.add_all(text_feats)
-        session.commit()
+        with Session() as session:
+            session.add_all(text_feats)
+            session.commit()
 
     print(f"Step: \"Text Features\" executed in {time.time() - start_time}s")
 
+def extract_text_features(prs: list[PullRequest]) -> list[PrText]:
+    return [extract_text_feature(pr) for pr in prs]
+
+def word_count(text: str | None) -> int:
+    if text is None:
+        return 0
+    return sum(1 for _ in WORD_PATTERN.finditer(text))
+
+def title_category(title: str, doc_pattern: re.Pattern | None = DOC_PATTERN, bug_pattern: re.Pattern | None = BUG_PATTERN) -> tuple[int, int]:
+    # Documentation keywords take precedence over bug fixing ones
+    if doc_pattern is not None and doc_pattern.search(title):
+        return 1, 0
+    if bug_pattern is not None and bug_pattern.search(title):
+        return 0, 1
+    return 0, 0
+
 def extract_text_feature(pr: PullRequest) -> PrText:
-    description_length = 0
-    is_documentation = 0
-    is_bug_fixing = 0
-    is_feature = 0
-
-    description = pr.body
-
-    if description is not None:
-        description_length = len(re.findall(r'\w+', description))
-
-    title = pr.title
-    doc_keywords = ['doc', 'docs', 'documentation', 'readme', 'license', 'copyright']
-    bug_keywords = ['bug', 'fix', 'repair', 'defect']
-    all_keywords = doc_keywords + bug_keywords
-    for word in all_keywords:
-        pattern = rf'(\b|\(|\[){re.escape(word)}(\b|\)|\]|:)'
-        if re.search(pattern, title, re.IGNORECASE):
-            if word in doc_keywords:
-                is_documentation = 1
-            elif word in bug_keywords:
-                is_bug_fixing = 1
-            break
-
-    if (is_documentation+is_bug_fixing) == 0:
-        is_feature = 1
+    is_documentation, is_bug_fixing = title_category(pr.title)
+    is_feature = int((is_documentation + is_bug_fixing) == 0)
 
     feats = PrText(
-        description_len=description_length,
+        description_len=word_count(pr.body),
         is_documentation=is_documentation,
         is_bug_fixing=is_bug_fixing,
         is_feature=is_feature,
@@ -56,3 +67,47 @@ def extract_text_feature(pr: PullRequest) -> PrText:
     )
 
     return feats
+
+# Expected (is_documentation, is_bug_fixing, is_feature) of titles with the default keywords, from the former
+# search of one keyword at a time. Keep in sync with the copy of the other tree.
+TITLE_GOLDEN = [
+    ('docs: update the install guide', (1, 0, 0)),
+    ('Docs(api): describe the rate limits', (1, 0, 0)),
+    ('(fix) crash on empty body', (0, 1, 0)),
+    ('[bug] wrong author count', (0, 1, 0)),
+    ('[Docs] typo', (1, 0, 0)),
+    ('fix: handle missing reviewers', (0, 1, 0)),
+    ('Fix docs typo', (1, 0, 0)),
+    ('Add a prefix option to the exporter', (0, 0, 1)),
+    ('Improve the docstring of the extractor', (0, 0, 1)),
+    ('Update README.md', (1, 0, 0)),
+    ('Bump copyright year', (1, 0, 0)),
+    ('Repair: broken link', (0, 1, 0)),
+    ('Fixes #12', (0, 0, 1)),
+    ('hotfix for the release', (0, 0, 1)),
+    ('bugfix in the sweep', (0, 0, 1)),
+    ('Remove debug logging', (0, 0, 1)),
+    ('defects report', (0, 0, 1)),
+    ('Update LICENSE', (1, 0, 0)),
+    ('Add documentation for the daemon', (1, 0, 0)),
+    ('Refactor the doc-builder', (1, 0, 0)),
+    ('Add new ranking model', (0, 0, 1)),
+    ('', (0, 0, 1)),
+]
+
+# Checks the title categories against the golden table, with the default keywords whatever the configured ones
+if __name__ == '__main__':
+    doc_pattern = keyword_pattern(DEFAULT_DOC_KEYWORDS.split(','))
+    bug_pattern = keyword_pattern(DEFAULT_BUG_KEYWORDS.split(','))
+
+    mismatches = []
+    for title, expected in TITLE_GOLDEN:
+        is_documentation, is_bug_fixing = title_category(title, doc_pattern, bug_pattern)
+        found = (is_documentation, is_bug_fixing, int((is_documentation + is_bug_fixing) == 0))
+        if found != expected:
+            mismatches.append((title, expected, found))
+
+    print(f"{len(TITLE_GOLDEN) - len(mismatches)}/{len(TITLE_GOLDEN)} titles match the golden table")
+    for title, expected, found in mismatches:
+        print(f"\t{title!r}: expected {expected}, found {found}")
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,145 @@
+import sys
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Hashable, NamedTuple
+
+from db.db import Session, PullRequest as db_PR
+
+# Point-in-time history statistics for every training PR in a single sweep: PR closures are sorted once
+# and a window [t - HISTORY_WINDOW, t] slides over them while running per-author and per-project
+# counters are kept up to date, which replaces one set of window queries per PR (O(N log N) overall)
+
+class PointInTime(NamedTuple):
+    author_closed: int
+    author_merged: int
+    author_total: int
+    project_closed: int
+    project_merged: int
+    project_authors: int
+    # Slice of HistorySweep.events closed within the window
+    first_event: int
+    last_event: int
+
+class HistorySweep:
+    def __init__(self, history: list[tuple[int, str, str, datetime | None, bool]]):
+        # Same semantics as the SQL queries: only closed PRs count in windows, totals count every PR
+        self.events = sorted(
+            (naive(closed), number, author, bool(merged))
+            for number, author, state, closed, merged in history
+            if state == 'closed' and closed is not None
+        )
+        self.totals = Counter(author for _, author, _, _, _ in history)
+
+    @classmethod
+    def from_db(cls) -> 'HistorySweep':
+        with Session() as session:
+            history = session.query(db_PR.number, db_PR.author, db_PR.state, db_PR.closed, db_PR.merged).all()
+        return cls(history)
+
+    def window_numbers(self, point: PointInTime) -> list[int]:
+        return [event[1] for event in self.events[point.first_event:point.last_event]]
+
+    def run(self, queries: list[tuple[Hashable, str, datetime]], window: timedelta) -> dict[Hashable, PointInTime]:
+        results = {}
+        closed = Counter()
+        merged = Counter()
+        project_closed = 0
+        project_merged = 0
+        head = 0
+        tail = 0
+
+        for key, author, at in sorted(queries, key=lambda query: naive(query[2])):
+            at = naive(at)
+            since = at - window
+
+            # Closures up to the query time enter the window
+            while head < len(self.events) and self.events[head][0] <= at:
+                _, _, event_author, event_merged = self.events[head]
+                closed[event_author] += 1
+                merged[event_author] += event_merged
+                project_closed += 1
+                project_merged += event_merged
+                head += 1
+
+            # Closures older than the window leave it
+            while tail < head and self.events[tail][0] < since:
+                _, _, event_author, event_merged = self.events[tail]
+                closed[event_author] -= 1
+                merged[event_author] -= event_merged
+                project_closed -= 1
+                project_merged -= event_merged
+                if closed[event_author] == 0:
+                    del closed[event_author]
+                    del merged[event_author]
+                tail += 1
+
+            results[key] = PointInTime(
+                author_closed = closed.get(author, 0),
+                author_merged = merged.get(author, 0),
+                author_total = self.totals[author],
+                project_closed = project_closed,
+                project_merged = project_merged,
+                project_authors = len(closed),
+                first_event = tail,
+                last_event = head,
+            )
+
+        return results
+
+# Stored dates are naive UTC, GitHub dates are aware UTC
+def naive(value: datetime) -> datetime:
+    return value.replace(tzinfo=None)
+
+def compare_with_sql(results: dict[int, PointInTime], queries: list[tuple[int, str, datetime]], window: timedelta) -> list[int]:
+    mismatches = []
+
+    with Session() as session:
+        for key, author, at in queries:
+            time_limit = at - window
+            project_query = session.query(db_PR).filter(
+                db_PR.state == 'closed',
+                db_PR.closed <= at,
+                db_PR.closed >= time_limit,
+            )
+            author_query = project_query.where(db_PR.author == author)
+
+            expected = (
+                author_query.count(),
+                author_query.where(db_PR.merged).count(),
+                session.query(db_PR).where(db_PR.author == author).count(),
+                project_query.count(),
+                project_query.where(db_PR.merged).count(),
+                project_query.with_entities(db_PR.author).distinct().count(),
+            )
+            if tuple(results[key][:6]) != expected:
+                mismatches.append(key)
+
+    return mismatches
+
+# Checks the sweep against the per-PR SQL queries on the local training database, or on a generated fixture
+#   python -m features.sweep
+#   python -m features.sweep --fixture 800
+if __name__ == '__main__':
+    import argparse
+    from features.config import HISTORY_RANGE_DAYS
+    from features.fixture import fixture_history, load_fixture
+
+    parser = argparse.ArgumentParser(description='Check the history sweep against the SQL queries')
+    parser.add_argument('--fixture', type=int, help='number of PRs of a generated history, instead of the local database')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generated history')
+    args = parser.parse_args()
+
+    window = timedelta(days=HISTORY_RANGE_DAYS)
+    if args.fixture:
+        rows, queries = fixture_history(args.fixture, window, args.seed)
+        load_fixture(rows)
+    else:
+        with Session() as session:
+            queries = [(pr.number, pr.author, pr.created) for pr in session.query(db_PR).where(db_PR.state == 'closed')]
+
+    sweep = HistorySweep.from_db()
+    mismatches = compare_with_sql(sweep.run(queries, window), queries, window)
+    print(f"{len(queries) - len(mismatches)}/{len(queries)} queries match the SQL results")
+    if mismatches:
+        print(f"\tMismatches: {mismatches[:20]}")
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,150 @@
+import argparse
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+
+from db.db import Session, PrCode
+from features.config import WRITE_CHUNK_SIZE
+from features.fixture import fixture_history, load_fixture
+
+# Usage, from the directory of the features package:
+#   python -m features.writer bench      Commits and times of a feature stage, one commit per PR vs chunks
+
+# Unit of work of a feature stage: the feature rows are buffered and written in chunks, every chunk in a
+# single transaction (the rows replaced by the chunk are deleted in the same transaction). A failing chunk
+# is rolled back and written again PR by PR, so that only the rows of the failing PRs are lost, then the
+# error is raised. The failing PRs and the PRs not reached are computed by the next run.
+class FeatureWriter:
+    def __init__(self, chunk_size: int = WRITE_CHUNK_SIZE):
+        self.chunk_size = max(chunk_size, 1)
+        self.rows = []
+        # PR numbers of the rows replaced by the buffered ones, by table
+        self.replaced = defaultdict(set)
+        self.written = 0
+        self.failed = 0
+        self.commits = 0
+
+    def add(self, row, replace: bool = False) -> None:
+        if replace:
+            self.replaced[type(row)].add(row.pr_num)
+
+        self.rows.append(row)
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def add_all(self, rows: list) -> None:
+        for row in rows:
+            self.add(row)
+
+    # Buffered row of the model with these values, the rows of the current chunk are not in the database yet
+    def find(self, model, **values):
+        for row in self.rows:
+            if isinstance(row, model) and all(getattr(row, name) == value for name, value in values.items()):
+                return row
+        return None
+
+    def flush(self) -> None:
+        if not self.rows:
+            return
+
+        rows, replaced = self.rows, self.replaced
+        self.rows, self.replaced = [], defaultdict(set)
+
+        try:
+            self.write(rows, replaced)
+        except SQLAlchemyError:
+            self.write_by_pr(rows, replaced)
+
+    def write(self, rows: list, replaced: dict) -> None:
+        # Rolled back on error when the session is closed
+        with Session() as session:
+            for model, numbers in replaced.items():
+                session.query(model).filter(model.pr_num.in_(numbers)).delete(synchronize_session=False)
+            session.bulk_save_objects(rows)
+            session.commit()
+
+        self.written += len(rows)
+        self.commits += 1
+
+    # The rows of a PR and the rows they replace are written together, the first error is raised at the end
+    def write_by_pr(self, rows: list, replaced: dict) -> None:
+        by_pr = defaultdict(list)
+        for row in rows:
+            # Rows not attached to a PR (users) are written one by one
+            by_pr[(type(row), row.pr_num if hasattr(row, 'pr_num') else id(row))].append(row)
+
+        error = None
+        for (model, number), pr_rows in by_pr.items():
+            try:
+                self.write(pr_rows, {model: {number}} if number in replaced.get(model, ()) else {})
+            except SQLAlchemyError as e:
+                self.failed += len(pr_rows)
+                error = error or e
+
+        print(f"\t{self.failed} feature rows not written")
+        if error is not None:
+            raise error
+
+    def __enter__(self) -> 'FeatureWriter':
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        self.flush()
+        return False
+
+def code_row(number: int, lines_added: int | None = 10) -> PrCode:
+    return PrCode(num_of_directory=1, modify_entropy=0.5, lines_added=lines_added, lines_deleted=2, files_added=1,
+                  files_deleted=0, files_modified=3, subsystem_num=1, pr_num=number)
+
+# Code features of a fixture history written as the stages did before (one commit per PR) and with the writer,
+# also with one invalid row (NULL lines_added) in the middle of the PRs
+def bench(count: int, chunk_size: int) -> None:
+    rows, _ = fixture_history(count, timedelta(days=30))
+    load_fixture(rows)
+    numbers = [row[0] for row in rows]
+
+    commits = [0]
+    event.listen(Session, 'after_commit', lambda session: commits.__setitem__(0, commits[0] + 1))
+
+    def one_commit_per_pr():
+        for number in numbers:
+            with Session() as session:
+                session.add(code_row(number))
+                session.commit()
+
+    def chunks(invalid: int | None = None):
+        with FeatureWriter(chunk_size) as writer:
+            for number in numbers:
+                writer.add(code_row(number, None if number == invalid else 10), replace=True)
+
+    print('| | Commits | Rows written | Time (s) |')
+    print('| --- | ---: | ---: | ---: |')
+    for name, write in (('one commit per PR', one_commit_per_pr), (f"chunks of {chunk_size}", chunks),
+                        (f"chunks of {chunk_size}, 1 invalid row", lambda: chunks(numbers[len(numbers) // 2]))):
+        with Session() as session:
+            session.query(PrCode).delete()
+            session.commit()
+        commits[0] = 0
+
+        start_time = time.time()
+        try:
+            write()
+        except SQLAlchemyError:
+            pass
+        elapsed = time.time() - start_time
+
+        with Session() as session:
+            written = session.query(PrCode).count()
+        print(f"| {name} | {commits[0]} | {written} | {elapsed:.2f} |")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the feature writer')
+    parser.add_argument('command', choices=['bench'])
+    parser.add_argument('--prs', type=int, default=2000, help='number of fixture PRs')
+    parser.add_argument('--chunk', type=int, default=WRITE_CHUNK_SIZE, help='rows per transaction')
+    args = parser.parse_args()
+
+    bench(args.prs, args.chunk)